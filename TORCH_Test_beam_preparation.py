@@ -1,9 +1,21 @@
+import pandas as pd
 import streamlit as st
-import pandas as pd 
-import glob 
-import os
 
-from utils.useful_functions import connect_db, initialize_data, load_data, PRIORITIES, STATUSES
+from utils import inventory
+from utils.analytics import archive_campaign, campaigns, task_figures
+from utils.cache import cache_stats, rerun_on_change
+from utils.connection import connection_stats
+from utils.profiling import profiled, show_profile, stage, start_profiling
+from utils.scheduling import load_schedule, timeline_chart, timeline_data
+from utils.useful_functions import (
+    connect_db,
+    initialize_data,
+    load_filter_options,
+    prepare_database,
+    query_tasks,
+    PRIORITIES,
+    STATUSES,
+)
 
 # Set the title and favicon that appear in the Browser's tab bar.
 st.set_page_config(
@@ -11,6 +23,10 @@ st.set_page_config(
     page_icon=":hammer_and_wrench:",  # This is an emoji shortcode. Could be a URL too.
 )
 
+# Bookkeeping columns of the tasks, not worth showing here.
+HIDDEN_COLUMNS = {"version": None, "updated_at": None}
+start_profiling("Home")
+
 
 st.write("# 2025 TORCH Test beam preparation :clipboard:")
 
@@ -20,90 +36,201 @@ st.markdown(
     """
 )
 
-# Get data 
-if "df" in st.session_state:
-    df = st.session_state.df
-else: 
-    # Connect to database and create table if needed
+# Connect to database and create table if needed
+with stage("connect"):
     conn, db_was_just_created = connect_db()
 
-    # Initialize data.
+    # Bring the schema up to date and initialize data.
+    prepare_database(conn)
     if db_was_just_created:
         initialize_data(conn)
         st.toast("Database initialized with some sample data.")
 
-    # Load data from database
-    df = load_data(conn)
-
-df['submission_date'] = pd.to_datetime(df["submission_date"])
+# Show the changes other people commit without them having to reload.
+rerun_on_change(conn, "tasks")
 
 # At glance 
 st.write("## A glance at the high priority tasks ")
 
-st.dataframe(df[df['priority']=='High'])
-
-st.write("## Browse tasks ")
-# Read selection from user 
-min_value_duration = df['duration'].min()
-max_value_duration = df['duration'].max()
-
-min_value_submission = df['submission_date'].min().to_pydatetime()
-max_value_submission = df['submission_date'].max().to_pydatetime()
-
-from_dur, to_dur = st.slider(
-    'Task duration',
-    min_value=min_value_duration,
-    max_value=max_value_duration+1,
-    value=[min_value_duration, max_value_duration])
-
-from_submitted, to_submitted = st.slider(
-    'Task submission date',
-    min_value=min_value_submission,
-    max_value=max_value_submission,
-    value=[min_value_submission, max_value_submission],
-    format="DD.MM.YYYY",
-    )
-
-
-contacts = df['contact_person'].unique()
-if not len(contacts):
-    st.warning("Select at least one contact person.")
-selected_persons = st.multiselect(
-    'Select based on contact persons',
-    contacts,
-    default=contacts,
-    )
-
-subsystems = df['sub_system'].unique()
-if not len(subsystems):
-    st.warning("Select at least one sub-system.")
-selected_systems = st.multiselect(
-    'Select based on sub-system',
-    subsystems,
-    default=subsystems,
-    )
-
-selected_priorities = st.multiselect(
-    'Select based on priority',
-    PRIORITIES,
-    default=PRIORITIES,
+with stage("glance"):
+    st.dataframe(query_tasks(conn, {"priority": ["High"]}), column_config=HIDDEN_COLUMNS)
+
+st.write("## Schedule ")
+# When everything can be done at the earliest, given the task durations and
+# dependencies. Tasks on the critical path delay the end if they are late.
+with stage("schedule"):
+    schedule = load_schedule(conn)
+    timeline = timeline_data(conn, schedule)
+
+today = pd.Timestamp.now().normalize()
+end_column, critical_column = st.columns(2)
+end_column.metric("Expected end", f"{today + pd.Timedelta(days=schedule.end):%d.%m.%Y}")
+critical_column.metric("Tasks on the critical path", len(schedule.critical_path()))
+if len(timeline):
+    st.altair_chart(timeline_chart(timeline), use_container_width=True)
+    st.caption("Tasks with the least slack, starting at the earliest. Done tasks are not shown.")
+
+
+# How this campaign compares with the archived ones. Archiving only reruns this.
+# Like every fragment, it connects in its own rerun, see `utils.connection.connect`.
+@st.fragment
+@profiled("campaigns")
+def campaigns_section():
+    """Shows the figures of each campaign, and lets the current one be archived."""
+    conn, _ = connect_db()
+    st.write("## Campaigns ")
+    with st.expander("Archive this campaign"):
+        name = st.text_input("Campaign name", placeholder="e.g. 2025 SPS", key="archive_name").strip()
+        if st.button("Archive tasks and inventory", key="archive_campaign", disabled=not name):
+            inventory_conn, _ = inventory.connect_db()
+            inventory.prepare_database(inventory_conn)
+            try:
+                archive_campaign(name, conn, inventory_conn)
+            except ValueError as error:
+                st.error(f"Nothing was archived. {error}")
+            else:
+                st.toast(f"Campaign {name} archived!")
+
+    if campaigns():
+        with stage("campaign figures"):
+            st.dataframe(task_figures(conn))
+        st.caption("Tasks of each status and days of work, in the archived campaigns and the current one.")
+    else:
+        st.caption("No campaign has been archived yet.")
+
+
+campaigns_section()
+
+
+def select_all_but(label, options, key, format_func):
+    """Shows a multiselect of `options`, all selected but those the user removed.
+
+    The widget remembers what was removed rather than what is selected, so
+    that new options, such as the contact person of a new task, come selected
+    and their tasks are not hidden.
+    """
+    deselected_key = f"{key}_deselected"
+    deselected = st.session_state.get(deselected_key, set())
+    st.session_state[key] = [value for value in options if value not in deselected]
+
+    def remember_deselected():
+        selected = st.session_state[key]
+        st.session_state[deselected_key] = (deselected - set(options)) | {
+            value for value in options if value not in selected
+        }
+
+    return st.multiselect(label, options, format_func=format_func, key=key, on_change=remember_deselected)
+
+
+# Changing a filter only reruns the filters and their results. The glance and
+# the schedule above only change with the data, and a change committed by
+# anyone reruns the whole page, see `rerun_on_change`.
+@st.fragment
+@profiled("browse tasks")
+def browse_tasks():
+    """Shows the filters and the tasks matching them."""
+    conn, _ = connect_db()
+    st.write("## Browse tasks ")
+    # Read selection from user. The widget options are cached until the tasks change.
+    with stage("filter options"):
+        options = load_filter_options(conn)
+
+    search = st.text_input(
+        'Search descriptions and contact persons',
+        placeholder='e.g. calibration Marion',
+        help='Tasks containing all the words are shown, best matches first. '
+             'Words also match longer words starting with them.',
+        )
+
+    min_value_duration, max_value_duration = options['duration']
+
+    min_value_submission, max_value_submission = (
+        date.to_pydatetime() for date in options['submission_date']
     )
 
-selected_status = st.multiselect(
-    'Select based on status',
-    STATUSES,
-    default=STATUSES,
-    )
+    from_dur, to_dur = st.slider(
+        'Task duration',
+        min_value=min_value_duration,
+        max_value=max_value_duration+1,
+        value=[min_value_duration, max_value_duration])
+
+    from_submitted, to_submitted = st.slider(
+        'Task submission date',
+        min_value=min_value_submission,
+        max_value=max_value_submission,
+        value=[min_value_submission, max_value_submission],
+        format="DD.MM.YYYY",
+        )
+
+
+    # Each option shows how many tasks have it. The keys keep the selections
+    # when the counts, and so the option labels, change, see `select_all_but`.
+    counts = options['counts']
+
+    def with_count(column):
+        return lambda value: f"{value} ({counts[column].get(value, 0)})"
+
+    contacts = options['contact_person']
+    if not len(contacts):
+        st.warning("Select at least one contact person.")
+    selected_persons = select_all_but(
+        'Select based on contact persons',
+        contacts,
+        format_func=with_count('contact_person'),
+        key='home_contacts',
+        )
+
+    subsystems = options['sub_system']
+    if not len(subsystems):
+        st.warning("Select at least one sub-system.")
+    selected_systems = select_all_but(
+        'Select based on sub-system',
+        subsystems,
+        format_func=with_count('sub_system'),
+        key='home_sub_systems',
+        )
+
+    selected_priorities = select_all_but(
+        'Select based on priority',
+        PRIORITIES,
+        format_func=with_count('priority'),
+        key='home_priorities',
+        )
+
+    selected_status = select_all_but(
+        'Select based on status',
+        STATUSES,
+        format_func=with_count('status'),
+        key='home_statuses',
+        )
+
+    # Filter the data in the database, so only the matching rows are loaded.
+    with stage("filter tasks"):
+        filtered_df = query_tasks(
+            conn,
+            {
+                'contact_person': selected_persons,
+                'priority': selected_priorities,
+                'sub_system': selected_systems,
+                'status': selected_status,
+                'duration': (from_dur, to_dur),
+                'submission_date': (from_submitted, to_submitted),
+            },
+            search=search,
+        )
+
+    with stage("show tasks"):
+        st.dataframe(filtered_df, column_config=HIDDEN_COLUMNS)
+
+
+browse_tasks()
+
+stats = cache_stats()
+st.sidebar.caption(f"Task cache: {stats['hits']} hits, {stats['misses']} misses")
+connections = connection_stats(conn.db_filename)
+st.sidebar.caption(
+    f"Task connections: {connections['opened']} opened, {connections['reused']} reused, "
+    f"{connections['recycled']} recycled"
+)
 
-# Filter the data
-filtered_df = df[
-    (df['contact_person'].isin(selected_persons))
-    & (df['priority'].isin(selected_priorities))
-    & (df['sub_system'].isin(selected_systems))
-    & (df['duration'] <= to_dur)
-    & (from_dur <= df['duration'])
-    & (df['submission_date'] <= to_submitted)
-    & (from_submitted <= df['submission_date'])
-]
-
-st.dataframe(filtered_df)
\ No newline at end of file
+show_profile()
@@ -0,0 +1,537 @@
+"""Times the data layer at scale, without a browser.
+
+Each operation runs against temporary databases filled with synthetic rows,
+see `benchmarks.generators`. Run from the repository root:
+
+    python -m benchmarks.data_layer --sizes 1000 10000 100000
+    python -m benchmarks.data_layer --compare old.json new.json
+
+Times are wall-clock seconds over `--repeat` runs after one warm-up run. Peak
+memory is measured in a separate run with `tracemalloc`, so it covers Python
+allocations (pandas, numpy and sqlite3 results) but neither SQLite's page
+cache nor Arrow buffers, see `utils.bulk.read_frame`. The operations of
+`RSS_OPERATIONS` also report the peak resident memory they add to a fresh
+process, which covers both.
+"""
+import argparse
+import io
+import itertools
+import json
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+from streamlit import logger as st_logger
+
+from benchmarks.generators import (
+    generate_dependencies,
+    generate_inventory,
+    generate_tasks,
+    write_dependencies,
+    write_inventory,
+    write_tasks,
+)
+from utils import analytics, inventory, scheduling
+from utils import useful_functions as tasks
+from utils.bulk import read_chunks
+from utils.cache import get_revision_cache
+from utils.connection import ConnectionManager, connect
+from utils.writer import WriteQueue
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+# Sessions committing at the same time in the concurrent commit benchmarks.
+CONCURRENT_SESSIONS = 8
+
+# name -> (function taking a `Fixture`, largest table size it runs on)
+BENCHMARKS = {}
+
+
+def benchmark(name, max_rows=None):
+    """Registers a benchmarked operation."""
+    def register(function):
+        BENCHMARKS[name] = (function, max_rows)
+        return function
+    return register
+
+
+class Fixture:
+    """A tasks and an inventory database with `n` synthetic rows each."""
+
+    def __init__(self, directory, n, seed):
+        self.n = n
+        self.directory = directory
+        self._imports = itertools.count()
+        self.tasks_path = directory / f"tasks_{n}.db"
+        self.tasks_conn, _ = connect(self.tasks_path)
+        tasks.prepare_database(self.tasks_conn)
+        write_tasks(self.tasks_conn, generate_tasks(n, seed))
+        write_dependencies(self.tasks_conn, generate_dependencies(n, seed))
+
+        self.inventory_path = directory / f"inventory_{n}.db"
+        self.inventory_conn, _ = connect(self.inventory_path)
+        inventory.prepare_database(self.inventory_conn)
+        inventory.initialize_data(self.inventory_conn)
+        write_inventory(self.inventory_conn, generate_inventory(n, seed))
+
+        self.contacts = tasks.load_filter_options(self.tasks_conn)["contact_person"]
+        last_id = self.tasks_conn.execute("SELECT MAX(id) FROM tasks").fetchone()[0]
+        self.deep_cursor = (last_id - 100, last_id - 100)
+        self.added_task_ids = []
+        self.added_item_ids = []
+        self.tasks_csv = tasks.export_tasks(self.tasks_conn, "csv")
+
+    def archive(self, campaigns=3):
+        """Returns an archive holding the current data as `campaigns` past campaigns."""
+        archive_dir = self.directory / f"archive_{self.n}"
+        if not archive_dir.exists():
+            for i in range(campaigns):
+                analytics.archive_campaign(f"Campaign {i}", self.tasks_conn, self.inventory_conn, archive_dir)
+        return archive_dir
+
+    def empty_tasks_db(self):
+        """Returns a connection to a new, migrated tasks database."""
+        manager = ConnectionManager(self.directory / f"import_{self.n}_{next(self._imports)}.db")
+        conn, _ = manager.connect()
+        tasks.prepare_database(conn)
+        return conn
+
+
+# -----------------------------------------------------------------------------
+# Operations, mirroring what the pages do on a rerun or a commit.
+
+
+@benchmark("connect_db.cold")
+def _connect_cold(f):
+    manager = ConnectionManager(f.tasks_path)
+    conn, _ = manager.connect()
+    tasks.prepare_database(conn)
+    manager.close_all()
+
+
+@benchmark("connect_db.warm")
+def _connect_warm(f):
+    conn, _ = connect(f.tasks_path)
+    tasks.prepare_database(conn)
+
+
+@benchmark("load_data.miss")
+def _load_data_miss(f):
+    get_revision_cache().clear()
+    tasks.load_data(f.tasks_conn)
+
+
+@benchmark("load_data.hit")
+def _load_data_hit(f):
+    tasks.load_data(f.tasks_conn)
+
+
+@benchmark("load_data.update")
+def _load_data_update(f):
+    # Someone else changed one task since the frame was cached.
+    tasks.load_data(f.tasks_conn)
+    with f.tasks_conn:
+        f.tasks_conn.execute("UPDATE tasks SET duration = duration + 1 WHERE id = 1")
+    tasks.load_data(f.tasks_conn)
+
+
+# The frame of all tasks built the two ways `read_frame` can: from the rows
+# fetched at once, and a chunk at a time into Arrow.
+def _read_tasks_fetchall(conn):
+    tasks.read_tasks(conn, arrow=False)
+
+
+def _read_tasks_arrow(conn):
+    tasks.read_tasks(conn)
+
+
+# name -> function taking a tasks connection, see `measure_rss`
+RSS_OPERATIONS = {
+    "load_data.fetchall": _read_tasks_fetchall,
+    "load_data.arrow": _read_tasks_arrow,
+}
+
+
+@benchmark("load_data.fetchall")
+def _load_data_fetchall(f):
+    _read_tasks_fetchall(f.tasks_conn)
+
+
+@benchmark("load_data.arrow")
+def _load_data_arrow(f):
+    _read_tasks_arrow(f.tasks_conn)
+
+
+@benchmark("filter_options.miss")
+def _filter_options_miss(f):
+    get_revision_cache().clear()
+    tasks.load_filter_options(f.tasks_conn)
+
+
+def _all_tasks_filters(f):
+    # The home page's default selection: everything.
+    return {
+        "contact_person": f.contacts,
+        "priority": tasks.PRIORITIES,
+        "sub_system": tasks.SUBSYSTEMS,
+        "status": tasks.STATUSES,
+        "duration": (0, 1_000),
+        "submission_date": (pd.Timestamp("2000-01-01"), pd.Timestamp("2100-01-01")),
+    }
+
+
+# The home_filter benchmarks clear the cache, so they time the query itself.
+@benchmark("home_filter.all")
+def _home_filter_all(f):
+    get_revision_cache().clear()
+    tasks.query_tasks(f.tasks_conn, _all_tasks_filters(f))
+
+
+@benchmark("home_filter.all.hit")
+def _home_filter_all_hit(f):
+    tasks.query_tasks(f.tasks_conn, _all_tasks_filters(f))
+
+
+@benchmark("home_filter.all.update")
+def _home_filter_all_update(f):
+    # Someone else changed one task since the results were cached.
+    tasks.query_tasks(f.tasks_conn, _all_tasks_filters(f))
+    with f.tasks_conn:
+        f.tasks_conn.execute("UPDATE tasks SET duration = duration + 1 WHERE id = 1")
+    tasks.query_tasks(f.tasks_conn, _all_tasks_filters(f))
+
+
+@benchmark("home_filter.selective")
+def _home_filter_selective(f):
+    get_revision_cache().clear()
+    tasks.query_tasks(
+        f.tasks_conn,
+        {
+            "contact_person": f.contacts[:1],
+            "priority": ["High"],
+            "duration": (10, 20),
+            "submission_date": (pd.Timestamp("2024-03-01"), pd.Timestamp("2024-06-01")),
+        },
+    )
+
+
+@benchmark("home_filter.search")
+def _home_filter_search(f):
+    get_revision_cache().clear()
+    tasks.query_tasks(f.tasks_conn, {"priority": ["High"]}, search="calibrate cab")
+
+
+@benchmark("task_page.first")
+def _task_page_first(f):
+    tasks.load_task_page(f.tasks_conn, {}, "submission_date", False, None, 50)
+
+
+@benchmark("task_page.deep")
+def _task_page_deep(f):
+    tasks.load_task_page(f.tasks_conn, {}, "id", True, f.deep_cursor, 50)
+
+
+@benchmark("update_data.tasks")
+def _update_tasks(f):
+    # 20 edits, 10 new tasks, and the 10 tasks added by the previous run deleted.
+    edited = tasks.query_tasks(f.tasks_conn, {"id": list(range(1, 21))})
+    edited["duration"] = edited["duration"] + 1
+    added = generate_tasks(10).drop(columns="id").to_dict("records")
+    tasks.commit_changes(f.tasks_conn, edited.to_dict("records") + added, f.added_task_ids)
+    f.added_task_ids = [
+        row_id for row_id, in f.tasks_conn.execute("SELECT id FROM tasks ORDER BY id DESC LIMIT 10")
+    ]
+
+
+@benchmark("schedule.build")
+def _schedule_build(f):
+    get_revision_cache().clear()
+    scheduling.load_schedule(f.tasks_conn)
+
+
+@benchmark("schedule.update")
+def _schedule_update(f):
+    # Someone else changed the duration of one task since the schedule was cached.
+    scheduling.load_schedule(f.tasks_conn)
+    with f.tasks_conn:
+        f.tasks_conn.execute("UPDATE tasks SET duration = IFNULL(duration, 0) + 1 WHERE id = ?", (f.n // 2,))
+    scheduling.load_schedule(f.tasks_conn)
+
+
+@benchmark("import.tasks_csv")
+def _import_tasks(f):
+    conn = f.empty_tasks_db()
+    file = io.BytesIO(f.tasks_csv)
+    file.name = "tasks.csv"
+    tasks.import_tasks(conn, read_chunks(file))
+    conn.close()
+
+
+@benchmark("export.tasks_csv")
+def _export_tasks_csv(f):
+    tasks.export_tasks(f.tasks_conn, "csv")
+
+
+@benchmark("export.tasks_parquet")
+def _export_tasks_parquet(f):
+    tasks.export_tasks(f.tasks_conn, "parquet")
+
+
+def _concurrent_commits(f, commit):
+    # Every session edits its own task a few times, as fast as it can.
+    def session(task_id):
+        for duration in range(5):
+            row = {"id": task_id, "description": f"task {task_id}", "sub_system": "HV",
+                   "status": "Done", "priority": "Low", "submission_date": pd.Timestamp("2025-01-01"),
+                   "duration": duration, "contact_person": "Bench"}
+            commit([row], [])
+
+    threads = [threading.Thread(target=session, args=(i + 1,)) for i in range(CONCURRENT_SESSIONS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+@benchmark("concurrent_commits.direct")
+def _concurrent_commits_direct(f):
+    def commit(rows, deleted_ids):
+        conn, _ = connect(f.tasks_path)
+        tasks.commit_changes(conn, rows, deleted_ids)
+
+    _concurrent_commits(f, commit)
+
+
+@benchmark("concurrent_commits.queued")
+def _concurrent_commits_queued(f):
+    # Sessions wait for their own write, as the page does before reporting it.
+    writer = WriteQueue(f.tasks_path)
+    _concurrent_commits(f, lambda rows, deleted_ids: writer.submit(tasks.write_changes, rows, deleted_ids).result())
+    writer.close()
+
+
+@benchmark("inventory.load_data")
+def _inventory_load(f):
+    inventory.load_data(f.inventory_conn)
+
+
+@benchmark("inventory.low_stock")
+def _inventory_low_stock(f):
+    inventory.load_low_stock(f.inventory_conn)
+
+
+@benchmark("update_data.inventory")
+def _update_inventory(f):
+    edited = inventory.load_page(f.inventory_conn, "", "id", True, None, 20)[0]
+    edited["units_left"] = edited["units_left"] + 1
+    added = generate_inventory(10).drop(columns="id").to_dict("records")
+    rows = [*edited.to_dict("records"), *({**row, "id": None} for row in added)]
+    inventory.commit_changes(f.inventory_conn, rows, f.added_item_ids)
+    f.added_item_ids = [
+        row_id for row_id, in f.inventory_conn.execute("SELECT id FROM inventory ORDER BY id DESC LIMIT 10")
+    ]
+
+
+@benchmark("inventory.charts")
+def _inventory_charts(f):
+    # The specs are what Streamlit sends to the browser.
+    get_revision_cache().clear()
+    inventory.chart_spec(f.inventory_conn, "units_left")
+    inventory.chart_spec(f.inventory_conn, "best_sellers")
+
+
+@benchmark("inventory.charts.hit")
+def _inventory_charts_hit(f):
+    inventory.chart_spec(f.inventory_conn, "units_left")
+    inventory.chart_spec(f.inventory_conn, "best_sellers")
+
+
+@benchmark("analytics.archives")
+def _analytics_archives(f):
+    # Every archived row is aggregated, by DuckDB when it is installed.
+    archive_dir = f.archive()
+    analytics.aggregate_snapshots("tasks", ["status"], ["duration"], archive_dir)
+    analytics.aggregate_snapshots("inventory", [], ["units_sold", "units_left"], archive_dir)
+
+
+@benchmark("analytics.figures")
+def _analytics_figures(f):
+    get_revision_cache().clear()
+    archive_dir = f.archive()
+    analytics.task_figures(f.tasks_conn, archive_dir)
+    analytics.sales_figures(f.inventory_conn, archive_dir)
+
+
+# -----------------------------------------------------------------------------
+
+
+def measure(function, fixture, repeat):
+    """Returns the timings and the peak traced memory of an operation."""
+    function(fixture)  # Warm-up.
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(fixture)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function(fixture)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "max_s": max(times),
+        "peak_mib": peak / 2**20,
+    }
+
+
+def measure_rss(name, tasks_path):
+    """Returns the peak resident memory operation `name` adds to a fresh process, in MiB.
+
+    The process connects to the tasks database at `tasks_path` and runs the
+    operation once, see `RSS_OPERATIONS`.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-m", "benchmarks.data_layer", "--rss-probe", name, str(tasks_path)],
+        cwd=Path(__file__).parent.parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(completed.stdout.splitlines()[-1])["added_mib"]
+
+
+def _rss_probe(name, tasks_path):
+    conn, _ = connect(tasks_path)
+    tasks.prepare_database(conn)
+    before = _max_rss_mib()
+    RSS_OPERATIONS[name](conn)
+    print(json.dumps({"added_mib": _max_rss_mib() - before}))
+
+
+def _max_rss_mib():
+    # Linux keeps `ru_maxrss` across fork and exec, so a fresh process starts
+    # with the peak of the benchmark that started it. The high-water mark in
+    # /proc is the fresh process's own.
+    status = Path("/proc/self/status")
+    if status.exists():
+        for line in status.read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 2**10
+
+    import resource  # Unix only, like the memory figures it gives.
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB elsewhere.
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 2**10
+
+
+def run(sizes, repeat, seed, only=None, ignore_limits=False):
+    """Runs the benchmarks and returns the results document."""
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for n in sizes:
+            start = time.perf_counter()
+            fixture = Fixture(Path(directory), n, seed)
+            print(f"Generated {n} tasks and items in {time.perf_counter() - start:.1f} s")
+
+            for name, (function, max_rows) in BENCHMARKS.items():
+                if only and not any(name.startswith(prefix) for prefix in only):
+                    continue
+                if max_rows is not None and n > max_rows and not ignore_limits:
+                    print(f"  {name:<28} skipped above {max_rows} rows")
+                    continue
+                result = {"operation": name, "rows": n, **measure(function, fixture, repeat)}
+                line = f"  {name:<28} median {result['median_s'] * 1e3:10.2f} ms   peak {result['peak_mib']:9.2f} MiB"
+                if name in RSS_OPERATIONS:
+                    result["peak_rss_mib"] = measure_rss(name, fixture.tasks_path)
+                    line += f"   RSS {result['peak_rss_mib']:9.2f} MiB"
+                results.append(result)
+                print(line)
+
+            fixture.tasks_conn.close()
+            fixture.inventory_conn.close()
+            get_revision_cache().clear()
+
+    return {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "pandas": pd.__version__,
+            # Whether the archives were aggregated by DuckDB or by pyarrow.
+            "duckdb": getattr(analytics.load_duckdb(), "__version__", None),
+            "platform": platform.platform(),
+            "sizes": sizes,
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def compare(old_path, new_path):
+    """Prints the median time of each operation in two result files."""
+    old, new = (
+        {(r["operation"], r["rows"]): r for r in json.loads(Path(p).read_text())["results"]}
+        for p in (old_path, new_path)
+    )
+    print(f"{'operation':<28} {'rows':>9} {'old ms':>10} {'new ms':>10} {'speedup':>8}")
+    for key in sorted(old.keys() & new.keys(), key=lambda k: (k[1], k[0])):
+        old_s, new_s = old[key]["median_s"], new[key]["median_s"]
+        print(f"{key[0]:<28} {key[1]:>9} {old_s * 1e3:10.2f} {new_s * 1e3:10.2f} {old_s / new_s:7.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="table sizes to run")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per operation")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument("--only", nargs="+", help="run operations starting with these names")
+    parser.add_argument("--ignore-limits", action="store_true", help="run every operation at every size")
+    parser.add_argument("--output", type=Path, help="result file, by default in benchmarks/results/")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    # Run by `measure_rss` in a fresh process.
+    parser.add_argument("--rss-probe", nargs=2, metavar=("OPERATION", "TASKS_DB"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # The caches behind the data layer work without a Streamlit runtime, but
+    # warn about it on every call.
+    st_logger.set_log_level("error")
+
+    if args.rss_probe:
+        _rss_probe(*args.rss_probe)
+        return
+
+    document = run(args.sizes, args.repeat, args.seed, args.only, args.ignore_limits)
+
+    output = args.output
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f"data_layer-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.write_text(json.dumps(document, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
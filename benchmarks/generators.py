@@ -0,0 +1,122 @@
+"""Deterministic synthetic data for the tasks and inventory databases.
+
+The same `n` and `seed` always give the same rows, so results of different
+benchmark runs can be compared.
+"""
+import numpy as np
+import pandas as pd
+
+from utils.inventory import INVENTORY_COLUMNS
+from utils.useful_functions import PRIORITIES, STATUSES, SUBSYSTEMS, TASK_COLUMNS
+
+WORDS = [
+    "check", "calibrate", "install", "cable", "test", "replace", "align", "read out",
+    "monitor", "document", "order", "ship", "cool", "power", "scan", "trigger",
+]
+
+# Rows written per `executemany` call.
+CHUNK_SIZE = 50_000
+
+
+def generate_tasks(n, seed=0):
+    """Returns `n` tasks as the app shows them (labels and datetimes)."""
+    rng = np.random.default_rng(seed)
+    words = np.array(WORDS, dtype=object)
+    # Roughly one contact person per 200 tasks, as in a large campaign.
+    contacts = np.array([f"Person {i:04d}" for i in range(max(4, n // 200))], dtype=object)
+
+    duration = pd.array(rng.integers(1, 60, n), dtype="Int64")
+    duration[rng.random(n) < 0.02] = pd.NA
+
+    return pd.DataFrame(
+        {
+            "id": np.arange(1, n + 1),
+            "description": (
+                pd.Series(words[rng.integers(0, len(words), n)]) + " "
+                + pd.Series(words[rng.integers(0, len(words), n)]) + " #"
+                + pd.Series(np.arange(n)).astype(str)
+            ),
+            "sub_system": pd.Categorical.from_codes(rng.integers(0, len(SUBSYSTEMS), n), SUBSYSTEMS),
+            "status": pd.Categorical.from_codes(rng.integers(0, len(STATUSES), n), STATUSES),
+            "priority": pd.Categorical.from_codes(rng.integers(0, len(PRIORITIES), n), PRIORITIES),
+            "submission_date": (
+                pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 730, n), unit="D")
+            ),
+            "duration": duration,
+            "contact_person": contacts[rng.integers(0, len(contacts), n)],
+        },
+        columns=TASK_COLUMNS,
+    )
+
+
+def generate_dependencies(n, seed=0):
+    """Returns dependencies between the tasks of `generate_tasks(n, seed)`.
+
+    Each task depends on up to 3 earlier tasks, mostly close ones, so there
+    are long chains like in a real preparation campaign.
+    """
+    rng = np.random.default_rng(seed)
+    task_id = np.repeat(np.arange(2, n + 1), rng.integers(0, 4, max(n - 1, 0)))
+    depends_on = task_id - np.minimum(rng.geometric(0.05, len(task_id)), task_id - 1)
+    return pd.DataFrame({"task_id": task_id, "depends_on": depends_on}).drop_duplicates()
+
+
+def generate_inventory(n, seed=0):
+    """Returns `n` inventory items."""
+    rng = np.random.default_rng(seed)
+    price = np.round(rng.uniform(0.5, 500, n), 2)
+
+    return pd.DataFrame(
+        {
+            "id": np.arange(1, n + 1),
+            "item_name": [f"Part {i:07d}" for i in range(n)],
+            "price": price,
+            "units_sold": rng.integers(0, 200, n),
+            "units_left": rng.integers(0, 50, n),
+            "cost_price": np.round(price * rng.uniform(0.4, 0.9, n), 2),
+            "reorder_point": rng.integers(1, 20, n),
+            "description": [f"Spare part number {i}" for i in range(n)],
+        },
+        columns=INVENTORY_COLUMNS,
+    )
+
+
+def write_tasks(conn, df):
+    """Inserts generated tasks into a migrated tasks database.
+
+    The database assigns the ids, so the tasks can go next to existing ones.
+    """
+    encoded = pd.DataFrame(
+        {
+            "description": df["description"],
+            "sub_system": df["sub_system"].astype(object),
+            "status": pd.Categorical(df["status"], categories=STATUSES).codes,
+            "priority": pd.Categorical(df["priority"], categories=PRIORITIES).codes,
+            "submission_date": (df["submission_date"] - pd.Timestamp(0)) // pd.Timedelta(seconds=1),
+            "duration": df["duration"].astype(object),
+            "contact_person": df["contact_person"].astype(object),
+        }
+    )
+    _write(conn, "tasks", encoded)
+
+
+def write_dependencies(conn, df):
+    """Inserts generated dependencies, for tasks written by `write_tasks`."""
+    _write(conn, "task_dependencies", df)
+
+
+def write_inventory(conn, df):
+    """Inserts generated items into an initialized inventory database.
+
+    The database assigns the ids, so the items can go next to existing ones.
+    """
+    _write(conn, "inventory", df.drop(columns="id"))
+
+
+def _write(conn, table, df):
+    columns = ", ".join(df.columns)
+    placeholders = ", ".join("?" * len(df.columns))
+    rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    with conn:
+        while chunk := [row for _, row in zip(range(CHUNK_SIZE), rows)]:
+            conn.executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", chunk)
@@ -0,0 +1,377 @@
+"""Load tests the pages with many sessions at once, without a browser.
+
+Each simulated session runs a page with Streamlit's `AppTest` on its own
+thread and scripts what people do during a prep meeting: changing filters on
+the home page, submitting the form, editing tasks and committing them on the
+Tasks page, and editing the inventory on the Material page. The databases are
+filled with synthetic rows, see `benchmarks.generators`. Run from the
+repository root:
+
+    python -m benchmarks.load_test --sessions 1 10 30 --sizes 1000 100000
+    python -m benchmarks.load_test --sessions 30 --pages Tasks
+
+Reruns share the process-wide caches, connections and write queues, like the
+sessions of one Streamlit server. Latencies are wall-clock seconds of a
+rerun, or for a commit, from the click until the write is saved.
+"""
+import argparse
+import json
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import streamlit
+from streamlit import config as st_config
+from streamlit import logger as st_logger
+from streamlit.runtime.pages_manager import PagesManager
+from streamlit.runtime.runtime import Runtime
+from streamlit.runtime.scriptrunner import magic
+from streamlit.testing.v1 import AppTest, app_test
+
+from benchmarks.generators import (
+    generate_dependencies,
+    generate_inventory,
+    generate_tasks,
+    write_dependencies,
+    write_inventory,
+    write_tasks,
+)
+from utils import inventory
+from utils import useful_functions as tasks
+from utils.connection import connect
+from utils.editing import fold_editor_changes
+from utils.writer import get_write_queue
+
+ROOT = Path(__file__).parent.parent
+
+# The Streamlit release `share_test_runtime` was written against. It patches
+# internals that change between releases without notice, so other releases
+# are refused rather than measured wrongly.
+STREAMLIT_VERSION = "1.66"
+RESULTS_DIR = Path(__file__).parent / "results"
+
+PAGES = {
+    "Home": "TORCH_Test_beam_preparation.py",
+    "Tasks": "pages/1_Tasks.py",
+    "Material": "pages/2_Material.py",
+}
+
+# Seconds between two checks that a commit has been saved.
+COMMIT_POLL_INTERVAL = 0.05
+
+
+class Session:
+    """One person using a page, recording how long each action takes."""
+
+    def __init__(self, page, rng, recorder):
+        # Like a server, start from the main script and open the page from
+        # there: pages run on their own are a different app to Streamlit.
+        self.app = AppTest.from_file(str(ROOT / PAGES["Home"]), default_timeout=120)
+        if page != "Home":
+            self.app.switch_page(PAGES[page])
+        self.page = page
+        self.rng = rng
+        self.recorder = recorder
+
+    def run(self, action, step=None):
+        """Applies `step` to the app, if any, and times the rerun."""
+        start = time.perf_counter()
+        if step is not None:
+            step(self.app)
+        self.app.run()
+        self.recorder.record(self.page, action, time.perf_counter() - start, self.app)
+
+    def commit(self, name):
+        """Clicks the commit button and waits until the write is saved."""
+        start = time.perf_counter()
+        widget(self.app.button, "Commit changes").click()
+        self.app.run()
+        paging = self.app.session_state[f"{name}_paging"]
+        while paging["writes"]:
+            time.sleep(COMMIT_POLL_INTERVAL)
+            self.app.run()
+        self.recorder.record(self.page, "commit", time.perf_counter() - start, self.app)
+
+        # Rows someone else changed first: keep their version and move on.
+        self.recorder.count_conflicts(len(paging["conflicts"]))
+        paging["conflicts"].clear()
+
+    def edit_rows(self, name, column, change, count=3):
+        """Edits rows of the page shown, as the editor would report it."""
+        paging = self.app.session_state[f"{name}_paging"]
+        df = paging["page_df"]
+        rows = self.rng.sample(range(len(df)), min(count, len(df)))
+        edited = {i: {column: change(df[column].iat[i])} for i in rows}
+        fold_editor_changes(paging["pending"], df, {"edited_rows": edited, "added_rows": [], "deleted_rows": []})
+
+
+def widget(widgets, label):
+    """Returns the widget with `label` among `widgets`."""
+    for w in widgets:
+        if w.label == label:
+            return w
+    raise LookupError(f"no widget labelled {label!r} among {[w.label for w in widgets]}")
+
+
+# -----------------------------------------------------------------------------
+# What people do on each page, one round at a time.
+
+
+def home_round(session):
+    contacts = widget(session.app.multiselect, "Select based on contact persons")
+    if contacts.options:
+        dropped = session.rng.choice(contacts.value) if contacts.value else None
+        session.run("filter", lambda app: contacts.unselect(dropped) if dropped else None)
+    session.run("search", lambda app: widget(app.text_input, "Search descriptions and contact persons").input(
+        session.rng.choice(["check", "calibrate cable", "Person 00", "test #1"])
+    ))
+    session.run("clear search", lambda app: widget(app.text_input, "Search descriptions and contact persons").input(""))
+
+
+def tasks_round(session):
+    def fill_in_form(app):
+        widget(app.text_area, "Describe the task").input(f"Load test task {session.rng.random():.6f}")
+        widget(app.selectbox, "Sub-system").select(session.rng.choice(tasks.SUBSYSTEMS))
+        widget(app.pills, "Status").set_value("Not Started")
+        widget(app.pills, "Priority").set_value(session.rng.choice(tasks.PRIORITIES))
+        widget(app.number_input, "Task expected duration (in days)").set_value(session.rng.randint(1, 20))
+        widget(app.text_input, "Contact person").input("Load tester")
+
+    session.run("fill in form", fill_in_form)
+    session.run("submit", lambda app: widget(app.button, "Submit").click())
+    session.run("next page", lambda app: widget(app.button, "Next page").click())
+    session.edit_rows("tasks", "duration", lambda value: (0 if value is None or value != value else int(value)) + 1)
+    session.run("edit")
+    session.commit("tasks")
+
+
+def material_round(session):
+    session.run("chart size", lambda app: widget(app.number_input, "Items per chart").set_value(
+        session.rng.choice([10, 25, 50])
+    ))
+    session.edit_rows("inventory", "units_left", lambda value: int(value) + 1)
+    session.run("edit")
+    session.commit("inventory")
+
+
+ROUNDS = {"Home": home_round, "Tasks": tasks_round, "Material": material_round}
+
+
+# -----------------------------------------------------------------------------
+# Running sessions.
+
+
+def share_test_runtime():
+    """Lets `AppTest` runs overlap on several threads.
+
+    Each run installs a mock Streamlit runtime and removes it when it ends,
+    which makes the runs still going in other threads fail. Once one has been
+    installed, the runs fall back to the last one instead. Each run also
+    forgets whether the app has a pages directory, and a run that reads it in
+    the meantime shows the home page; the app always has one, so it is kept.
+    """
+    last = []
+
+    def instance(cls):
+        runtime = cls._instance
+        if runtime is not None:
+            last[:] = [runtime]
+            return runtime
+        if last:
+            return last[0]
+        raise RuntimeError("Runtime hasn't been created!")
+
+    def exists(cls):
+        return cls._instance is not None or bool(last)
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(exists)
+
+    # `AppTest` resets the flag on the class it imported: give it a subclass.
+    app_test.PagesManager = type("PagesManager", (PagesManager,), {})
+
+    # Every run also parses the page again, which Python 3.11 cannot do on
+    # two threads at once; a server compiles each page once.
+    add_magic = magic.add_magic
+    lock = threading.Lock()
+
+    def add_magic_alone(*args, **kwargs):
+        with lock:
+            return add_magic(*args, **kwargs)
+
+    magic.add_magic = add_magic_alone
+
+
+class Recorder:
+    """Collects latencies and errors from every session thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = []
+        self.conflicts = 0
+
+    def record(self, page, action, seconds, app):
+        with self._lock:
+            self.latencies[(page, action)].append(seconds)
+            self.errors += [f"{page} {action}: {exception.value}" for exception in app.exception]
+
+    def count_conflicts(self, count):
+        with self._lock:
+            self.conflicts += count
+
+    def fail(self, page, error):
+        with self._lock:
+            self.errors.append(f"{page}: {error}")
+
+
+def run_session(page, rounds, seed, recorder):
+    rng = random.Random(seed)
+    try:
+        session = Session(page, rng, recorder)
+        session.run("first run")
+        for _ in range(rounds):
+            ROUNDS[page](session)
+    except Exception:
+        recorder.fail(page, traceback.format_exc(limit=3).strip().splitlines()[-1])
+
+
+def load_test(sessions, pages, rounds, seed):
+    """Runs `sessions` sessions at once, spread over `pages`, and returns the recorder."""
+    recorder = Recorder()
+    threads = [
+        threading.Thread(target=run_session, args=(pages[i % len(pages)], rounds, seed + i, recorder))
+        for i in range(sessions)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder
+
+
+def prepare_databases(directory, n, seed):
+    """Fills new databases with `n` tasks and items and points the app at them."""
+    tasks.DB_FILENAME = directory / f"tasks_{n}.db"
+    inventory.DB_FILENAME = directory / f"inventory_{n}.db"
+
+    conn, _ = connect(tasks.DB_FILENAME)
+    tasks.prepare_database(conn)
+    write_tasks(conn, generate_tasks(n, seed))
+    write_dependencies(conn, generate_dependencies(n, seed))
+
+    conn, _ = connect(inventory.DB_FILENAME)
+    inventory.prepare_database(conn)
+    write_inventory(conn, generate_inventory(n, seed))
+
+
+def write_stats():
+    """Returns the statistics of the write queues of both databases so far."""
+    return {
+        name: dict(get_write_queue(str(Path(path).resolve())).stats)
+        for name, path in (("tasks", tasks.DB_FILENAME), ("inventory", inventory.DB_FILENAME))
+    }
+
+
+def summarize(recorder, sessions, n, elapsed, writes_before):
+    """Returns the latency percentiles of each action, and of all of them."""
+    rows = []
+    groups = {**recorder.latencies, ("all", "all"): [t for ts in recorder.latencies.values() for t in ts]}
+    for (page, action), times in groups.items():
+        p50, p95, p99 = np.percentile(times, [50, 95, 99]) if times else (float("nan"),) * 3
+        rows.append({
+            "sessions": sessions, "rows": n, "page": page, "action": action, "count": len(times),
+            "p50_s": p50, "p95_s": p95, "p99_s": p99,
+        })
+
+    # The queues live as long as the process: keep what this run added.
+    writes = {
+        name: {key: value - writes_before[name][key] for key, value in stats.items()}
+        for name, stats in write_stats().items()
+    }
+    return {
+        "sessions": sessions,
+        "rows": n,
+        "elapsed_s": elapsed,
+        "actions": rows,
+        "errors": recorder.errors,
+        "locked_errors": sum("database is locked" in error for error in recorder.errors),
+        "conflicts": recorder.conflicts,
+        "writes": writes,
+    }
+
+
+def print_summary(summary):
+    print(f"\n{summary['sessions']} sessions, {summary['rows']} rows, {summary['elapsed_s']:.1f} s")
+    print(f"  {'page':<9} {'action':<13} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for row in summary["actions"]:
+        print(
+            f"  {row['page']:<9} {row['action']:<13} {row['count']:>6}"
+            f" {row['p50_s'] * 1e3:9.0f} {row['p95_s'] * 1e3:9.0f} {row['p99_s'] * 1e3:9.0f}"
+        )
+    for name, stats in summary["writes"].items():
+        print(
+            f"  {name} writes: {stats['writes']} in {stats['transactions']} transactions,"
+            f" {stats['failed']} failed, {stats['lock_wait_s'] * 1e3:.0f} ms waiting for the lock"
+        )
+    print(f"  conflicts: {summary['conflicts']}")
+    print(f"  errors: {len(summary['errors'])} ({summary['locked_errors']} database is locked)")
+    for error in sorted(set(summary["errors"]))[:5]:
+        print(f"    {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 30], help="concurrent sessions to run")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000], help="table sizes to run")
+    parser.add_argument("--pages", nargs="+", choices=list(PAGES), default=list(PAGES), help="pages the sessions use")
+    parser.add_argument("--rounds", type=int, default=3, help="rounds of actions per session")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the data and the actions")
+    parser.add_argument("--output", type=Path, help="result file, by default in benchmarks/results/")
+    args = parser.parse_args(argv)
+
+    if ".".join(streamlit.__version__.split(".")[:2]) != STREAMLIT_VERSION:
+        parser.exit(
+            1,
+            f"The load test patches Streamlit {STREAMLIT_VERSION} internals, see `share_test_runtime`, "
+            f"but Streamlit {streamlit.__version__} is installed. Install Streamlit {STREAMLIT_VERSION}, "
+            "or check the patches against this release and update STREAMLIT_VERSION.\n",
+        )
+
+    # The app's caches warn on every call made outside a script run, and
+    # reading the config sets the log level again, so read it first.
+    st_config.get_option("logger.level")
+    st_logger.set_log_level("error")
+    share_test_runtime()
+
+    summaries = []
+    with tempfile.TemporaryDirectory() as directory:
+        for n in args.sizes:
+            start = time.perf_counter()
+            prepare_databases(Path(directory), n, args.seed)
+            print(f"Generated {n} tasks and items in {time.perf_counter() - start:.1f} s")
+            for sessions in args.sessions:
+                writes_before = write_stats()
+                start = time.perf_counter()
+                recorder = load_test(sessions, args.pages, args.rounds, args.seed)
+                summary = summarize(recorder, sessions, n, time.perf_counter() - start, writes_before)
+                print_summary(summary)
+                summaries.append(summary)
+
+    output = args.output
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f"load_test-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.write_text(json.dumps({"sqlite": sqlite3.sqlite_version, "streamlit": streamlit.__version__, "runs": summaries}, indent=2, default=str))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
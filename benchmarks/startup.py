@@ -0,0 +1,151 @@
+"""Times the cold start of each page and fails when it is over budget.
+
+Each page is started in a fresh Python process, as after a restart of the app:
+the modules it imports are timed first, then its first run with Streamlit's
+`AppTest`, against copies of the databases. Run from the repository root:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --import-budget 0.5 --render-budget 1.5
+
+Times are the median of `--repeat` processes, in seconds. The exit status is
+1 when a page is over budget, so it can guard a deployment.
+"""
+import argparse
+import ast
+import json
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+PAGES = {
+    "Home": "TORCH_Test_beam_preparation.py",
+    "Tasks": "pages/1_Tasks.py",
+    "Material": "pages/2_Material.py",
+}
+
+# Seconds a page may take on a cold start, above the import of Streamlit
+# itself, which no page can avoid. The imports take about 0.2 s on a laptop,
+# and 0.35 s with Altair and Parquet loaded up front.
+IMPORT_BUDGET = 0.3
+RENDER_BUDGET = 1.0
+
+# Slow to import, and only needed by some of the work a page may do.
+HEAVY_MODULES = ["altair", "pyarrow.parquet", "pyarrow.dataset", "duckdb"]
+
+
+def page_imports(script):
+    """Returns the modules a page script imports at its top level."""
+    modules = []
+    for node in ast.parse((ROOT / script).read_text()).body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+    return modules
+
+
+def start_page(script, directory):
+    """Starts a page in this process and returns its timings.
+
+    Must run in a process that has not imported anything else yet.
+    """
+    start = time.perf_counter()
+    import streamlit  # noqa: F401
+    from streamlit import logger as st_logger
+    from streamlit.testing.v1 import AppTest
+
+    streamlit_s = time.perf_counter() - start
+    st_logger.set_log_level("error")
+
+    start = time.perf_counter()
+    for module in page_imports(script):
+        __import__(module)
+    import_s = time.perf_counter() - start
+    heavy = [module for module in HEAVY_MODULES if module in sys.modules]
+
+    # The page must not migrate or write to the databases of the repository.
+    from utils import inventory
+    from utils import useful_functions as tasks
+
+    for module in (tasks, inventory):
+        copy = Path(directory) / module.DB_FILENAME.name
+        if module.DB_FILENAME.exists():
+            shutil.copy(module.DB_FILENAME, copy)
+        module.DB_FILENAME = copy
+
+    app = AppTest.from_file(str(ROOT / script), default_timeout=60)
+    start = time.perf_counter()
+    app.run()
+    render_s = time.perf_counter() - start
+
+    return {
+        "streamlit_s": streamlit_s,
+        "import_s": import_s,
+        "render_s": render_s,
+        "heavy_modules": heavy,
+        "exceptions": [exception.value for exception in app.exception],
+    }
+
+
+def measure(script, repeat):
+    """Starts a page `repeat` times in new processes and returns the medians."""
+    runs = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as directory:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.startup", "--child", script, directory],
+                cwd=ROOT, capture_output=True, text=True, check=True,
+            ).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    return {
+        **{
+            key: statistics.median(run[key] for run in runs)
+            for key in ("streamlit_s", "import_s", "render_s")
+        },
+        "heavy_modules": runs[-1]["heavy_modules"],
+        "exceptions": runs[-1]["exceptions"],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3, help="cold starts per page")
+    parser.add_argument("--pages", nargs="+", choices=list(PAGES), default=list(PAGES), help="pages to start")
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET, help="seconds allowed for imports")
+    parser.add_argument("--render-budget", type=float, default=RENDER_BUDGET, help="seconds allowed for the first run")
+    parser.add_argument("--child", nargs=2, metavar=("SCRIPT", "DIRECTORY"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(start_page(*args.child)))
+        return 0
+
+    over_budget = False
+    print(f"{'page':<10} {'streamlit ms':>12} {'import ms':>10} {'render ms':>10}  heavy modules loaded")
+    for name in args.pages:
+        result = measure(PAGES[name], args.repeat)
+        print(
+            f"{name:<10} {result['streamlit_s'] * 1e3:12.0f} {result['import_s'] * 1e3:10.0f}"
+            f" {result['render_s'] * 1e3:10.0f}  {', '.join(result['heavy_modules']) or '-'}"
+        )
+        if result["exceptions"]:
+            print(f"  {name} failed: {result['exceptions']}")
+            over_budget = True
+        if result["import_s"] > args.import_budget:
+            print(f"  {name} imports take over {args.import_budget} s")
+            over_budget = True
+        if result["render_s"] > args.render_budget:
+            print(f"  {name} first run takes over {args.render_budget} s")
+            over_budget = True
+
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
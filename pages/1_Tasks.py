@@ -1,32 +1,65 @@
-import datetime
-import sqlite3
-import altair as alt
-import numpy as np
 import pandas as pd
 import streamlit as st
-from collections import defaultdict
-import glob 
-from pathlib import Path
-import os
 
-from utils.useful_functions import connect_db, initialize_data, load_data, STATUSES, PRIORITIES
+from utils.bulk import import_export_panel
+from utils.cache import cache_stats
+from utils.connection import connection_stats
+from utils.editing import (
+    PAGE_SIZES,
+    add_rows,
+    apply_pending,
+    commit_pending,
+    editor_changes,
+    editor_key,
+    has_pending_changes,
+    init_paging,
+    page_navigation,
+    resolve_conflicts,
+    restart_paging,
+    shown_pending,
+    write_status,
+)
+from utils.profiling import profiled, show_profile, stage, start_profiling
+from utils.scheduling import dependencies_panel
+from utils.useful_functions import (
+    DB_FILENAME,
+    connect_db,
+    count_tasks,
+    export_tasks,
+    import_tasks,
+    initialize_data,
+    load_task_page,
+    memory_footprint,
+    prepare_database,
+    write_changes,
+    STATUSES,
+    PRIORITIES,
+    SUBSYSTEMS,
+)
 
-def update_data(conn, df):
-    df.to_sql(name='tasks', con=conn, if_exists='replace', index=False)
-    st.toast("Database updated!")
+# Columns the task table can be sorted on.
+SORT_COLUMNS = {
+    "id": "Task ID",
+    "submission_date": "Submission date",
+    "priority": "Priority",
+    "status": "Status",
+    "duration": "Duration",
+}
+
+def update_data():
+    """Queues only the added, edited and deleted tasks to be written to the database."""
+    commit_pending("tasks", DB_FILENAME, write_changes)
     st.session_state.has_uncommitted_changes = False
 
 def lock():
     st.session_state.lock = True
 
 def validated_submission():
-    task_id = int(max(st.session_state.df['id']) + 1)
-    #task_id = int(max(df['id']) + st.session_state.attempt)
     issue = st.text_area("Describe the task", disabled=st.session_state.lock, key=f"issue_{st.session_state.attempt}")
-    subsystem = st.selectbox("Sub-system", subsystems, disabled=st.session_state.lock, key=f"subsystem_{st.session_state.attempt}")
-    task_status = st.pills("Status", ["Not started", "In Progress"], disabled=st.session_state.lock, key=f"status_{st.session_state.attempt}")
+    subsystem = st.selectbox("Sub-system", SUBSYSTEMS, disabled=st.session_state.lock, key=f"subsystem_{st.session_state.attempt}")
+    task_status = st.pills("Status", ["Not Started", "In Progress"], disabled=st.session_state.lock, key=f"status_{st.session_state.attempt}")
     priority = st.pills("Priority", ["High", "Medium", "Low"], disabled=st.session_state.lock, key=f"priority_{st.session_state.attempt}")
-    duration = st.number_input("Task expected duration (in days)", disabled=st.session_state.lock, key=f"duration_{st.session_state.attempt}")
+    duration = st.number_input("Task expected duration (in days)", min_value=0, step=1, disabled=st.session_state.lock, key=f"duration_{st.session_state.attempt}")
     contact = st.text_input("Contact person", disabled=st.session_state.lock, key=f"contact_{st.session_state.attempt}")
 
     submit = st.button("Submit", on_click=lock)
@@ -40,7 +73,6 @@ def validated_submission():
             st.rerun()
         # Accept the submission
         else:
-            st.session_state.task_id = task_id
             st.session_state.issue = issue
             st.session_state.subsystem = subsystem
             st.session_state.task_status = task_status
@@ -54,7 +86,6 @@ def validated_submission():
             st.rerun()
             
 def delete_submission():
-    del st.session_state.task_id
     del st.session_state.issue
     del st.session_state.subsystem
     del st.session_state.task_status
@@ -63,39 +94,32 @@ def delete_submission():
     del st.session_state.contact
 
 @st.fragment
+@profiled("add a task")
 def fill_in_form():
 
     validated_submission()
     if "task_status" in st.session_state:
-        # Make a dataframe for the new task and append it to the dataframe in session
-        # state.
-        today = datetime.datetime.now().strftime("%d-%m-%Y")
-        df_new = pd.DataFrame(
-            [
-                {   
-                    "id": st.session_state.task_id,
-                    "description": st.session_state.issue,
-                    "sub_system": st.session_state.subsystem,
-                    "status": st.session_state.task_status,
-                    "priority": st.session_state.priority,
-                    "submission_date": today,
-                    "duration": st.session_state.duration,
-                    "contact_person": st.session_state.contact,
-                }
-            ]
-        )
+        # Make a record for the new task, to be added to the pending changes.
+        # It only becomes part of a frame when the first page is shown.
+        new_task = {
+            "description": st.session_state.issue,
+            "sub_system": st.session_state.subsystem,
+            "status": st.session_state.task_status,
+            "priority": st.session_state.priority,
+            "submission_date": pd.Timestamp.now().normalize(),
+            "duration": st.session_state.duration,
+            "contact_person": st.session_state.contact,
+        }
         # Show a little success message.
         st.toast("Task submitted!")
-        #st.dataframe(df_new, use_container_width=True, hide_index=True)
-        # Convert the date column to date format
-        df_new["submission_date"] = pd.to_datetime(df_new["submission_date"], dayfirst=True)
         delete_submission()
 
-        return df_new
+        return new_task
 
 # -----------------------------------------------------------------------------
 # Show app title and description.
 st.set_page_config(page_title="Tasks", page_icon=":card_file_box:")
+start_profiling("Tasks")
 st.title(":card_file_box: Tasks")
 st.info(
     """
@@ -105,87 +129,176 @@ st.info(
 )
 
 # Connect to database and create table if needed
-conn, db_was_just_created = connect_db()
+with stage("connect"):
+    conn, db_was_just_created = connect_db()
 
-# Initialize data.
-if db_was_just_created:
-    initialize_data(conn)
-    st.toast("Database initialized with some sample data.")
+    # Bring the schema up to date and initialize data.
+    prepare_database(conn)
+    if db_was_just_created:
+        initialize_data(conn)
+        st.toast("Database initialized with some sample data.")
 
-# Load data from database
-df = load_data(conn)
-df['submission_date'] = pd.to_datetime(df["submission_date"])
-if "df" not in st.session_state:
-    st.session_state.df = df
-
-# Initialization
-last_id = max(df['id'])
+# Only one page of tasks is loaded and shown at a time. Changes are kept by
+# task id until they are committed, so they survive turning pages.
+paging = init_paging("tasks")
 
 # Show a section to add a new task.
 st.header("Add a task")
 
 # We're adding tickets via an `st.form` and some input widgets. If widgets are used
 # in a form, the app will only rerun once the submit button is pressed.
-subsystems = ["HV", "LV", "DAQ/monitoring", "Time reference", "MCP", "Electronics", "Cooling", "Trigger", "Beamline", "Mechanics/Prototype", "Planning"]
-
 if "attempt" not in st.session_state:
     st.session_state.attempt = 1
 if "lock" not in st.session_state:
     st.session_state.lock = False
 
-new_row = fill_in_form()
-st.session_state.df = pd.concat([new_row, st.session_state.df], axis=0, ignore_index=True)
+# Submitting a task reruns the whole page, see `validated_submission`, so the
+# table below shows it.
+new_task = fill_in_form()
+if new_task is not None:
+    # New tasks get a provisional id from a counter and are shown on top of
+    # the first page.
+    restart_paging("tasks")
+    add_rows(paging["pending"], [new_task])
 
 # Show section to view and edit existing tickets in a table.
 st.header("Existing tasks")
-st.write(f"Number of tasks: `{len(st.session_state.df)}`")
-
-# Show the tickets dataframe with `st.data_editor`. This lets the user edit the table
-# cells. The edited data is returned as a new dataframe.
-edited_df = st.data_editor(
-    st.session_state.df,
-    use_container_width=True,
-    hide_index=True,
-    num_rows="dynamic",  # Allow appending/deleting rows.
-    column_config={
-        "id" : "Task ID",
-        "description" : "Description",
-        "sub_system" : "Sub-system",
-        "status": st.column_config.SelectboxColumn(
-            "Status",
-            help="Task status",
-            options=STATUSES,
-            required=True,
-        ),
-        "priority": st.column_config.SelectboxColumn(
-            "Priority",
-            help="Priority",
-            options=PRIORITIES,
-            required=True,
-        ),
-        "submission_date" : st.column_config.DateColumn(
-            "Submisison Date",
-            format="DD.MM.YYYY",
-        ),
-        "duration" : "Duration",
-        "contact_person" : "Contact Person",
-    },
-    # Disable editing the ID and Date Submitted columns.
-    disabled=["id", "submission_date", "sub_system"],
-    key="tasks_table",
-)
 
-elements_were_added = bool(len(st.session_state.df) > len(df))
-table_was_edited = any(len(v) for v in st.session_state.tasks_table.values())
-st.session_state.has_uncommitted_changes = elements_were_added or table_was_edited
+with st.expander("Import and export"):
+    import_export_panel(
+        "tasks", "tasks", conn, import_tasks, export_tasks, connect_db,
+        on_import=lambda: restart_paging("tasks"),
+    )
+
+# Dependencies only show on the home page: saving them only reruns the panel.
+# The fragments below connect in their own reruns, see `utils.connection.connect`.
+@st.fragment
+@profiled("dependencies")
+def dependencies():
+    conn, _ = connect_db()
+    dependencies_panel(conn)
+
+
+with st.expander("Dependencies"):
+    dependencies()
+
+
+# Sorting, paging, editing and resolving conflicts only rerun the table. A
+# saved commit reruns the whole page, see `write_status`.
+@st.fragment
+@profiled("task table")
+def task_table():
+    """Shows a page of tasks in an editor, and the buttons to turn pages and commit."""
+    conn, _ = connect_db()
+    with st.expander("Sort and filter"):
+        sort_column = st.selectbox(
+            "Sort by", list(SORT_COLUMNS), format_func=SORT_COLUMNS.get,
+            key="tasks_sort", on_change=restart_paging, args=("tasks",),
+        )
+        ascending = st.toggle(
+            "Ascending", value=True, key="tasks_ascending", on_change=restart_paging, args=("tasks",),
+        )
+        filters = {
+            "sub_system": st.multiselect(
+                "Sub-system", SUBSYSTEMS, default=[],
+                key="tasks_sub_systems", on_change=restart_paging, args=("tasks",),
+            ) or None,
+            "status": st.multiselect(
+                "Status", STATUSES, default=[],
+                key="tasks_statuses", on_change=restart_paging, args=("tasks",),
+            ) or None,
+        }
+        page_size = st.selectbox(
+            "Tasks per page", PAGE_SIZES, index=1,
+            key="tasks_page_size", on_change=restart_paging, args=("tasks",),
+        )
+
+    # Read the page when it is entered. It is then kept as is, because the editor's
+    # deltas refer to its row positions.
+    if paging["page_df"] is None:
+        with stage("load page"):
+            page_df, paging["next_cursor"] = load_task_page(
+                conn, filters, sort_column, ascending, paging["cursors"][-1], page_size
+            )
+            is_first_page = len(paging["cursors"]) == 1
+            paging["page_df"] = apply_pending(page_df, shown_pending(paging), include_added=is_first_page)
+
+    with stage("count tasks"):
+        st.write(f"Number of tasks: `{count_tasks(conn, filters)}`")
+
+    # Show the tickets dataframe with `st.data_editor`. This lets the user edit the table
+    # cells. The edits are read back through `editor_changes`.
+    # Contact persons are stored as a categorical, which the editor would turn into a
+    # selectbox; give it plain strings so new names can be typed in.
+    with stage("editor"):
+        st.data_editor(
+            paging["page_df"].astype({"contact_person": "string"}),
+            use_container_width=True,
+            hide_index=True,
+            num_rows="dynamic",  # Allow appending/deleting rows.
+            column_config={
+                "id" : "Task ID",
+                "description" : "Description",
+                "sub_system" : "Sub-system",
+                "status": st.column_config.SelectboxColumn(
+                    "Status",
+                    help="Task status",
+                    options=STATUSES,
+                    required=True,
+                ),
+                "priority": st.column_config.SelectboxColumn(
+                    "Priority",
+                    help="Priority",
+                    options=PRIORITIES,
+                    required=True,
+                ),
+                "submission_date" : st.column_config.DateColumn(
+                    "Submisison Date",
+                    format="DD.MM.YYYY",
+                ),
+                "duration" : "Duration",
+                "contact_person" : "Contact Person",
+                "version" : "Version",
+                "updated_at" : st.column_config.DatetimeColumn(
+                    "Last updated",
+                    format="DD.MM.YYYY HH:mm",
+                ),
+            },
+            # Disable editing the ID and Date Submitted columns.
+            disabled=["id", "submission_date", "sub_system", "version", "updated_at"],
+            key=editor_key("tasks"),
+        )
+
+    page_navigation("tasks")
+
+    elements_were_added = bool(paging["pending"]["added"])
+    table_was_edited = has_pending_changes(paging["pending"]) or any(
+        len(v) for v in editor_changes("tasks").values()
+    )
+    st.session_state.has_uncommitted_changes = elements_were_added or table_was_edited
+
+    st.button(
+        "Commit changes",
+        type="primary",
+        disabled=not st.session_state.has_uncommitted_changes,
+        # Update data in database, in the background.
+        on_click=update_data,
+    )
+    write_status("tasks")
+
+    # Changes to tasks someone else changed first wait here to be merged.
+    resolve_conflicts("tasks")
 
-added_rows = st.session_state.df[st.session_state.df['id'] > last_id].reset_index()
 
-st.button(
-    "Commit changes",
-    type="primary",
-    disabled=not st.session_state.has_uncommitted_changes,
-    # Update data in database
-    on_click=update_data,
-    args=(conn, edited_df),
-)
\ No newline at end of file
+task_table()
+
+stats = cache_stats()
+st.sidebar.caption(f"Task cache: {stats['hits']} hits, {stats['misses']} misses")
+connections = connection_stats(conn.db_filename)
+st.sidebar.caption(
+    f"Task connections: {connections['opened']} opened, {connections['reused']} reused, "
+    f"{connections['recycled']} recycled"
+)
+st.sidebar.caption(f"Tasks page in memory: {memory_footprint(paging['page_df']) / 1024:.0f} KiB")
+
+show_profile()
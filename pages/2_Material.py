@@ -1,166 +1,59 @@
-from collections import defaultdict
-from pathlib import Path
-import sqlite3
-
 import streamlit as st
-import altair as alt
-import pandas as pd
-
-# -----------------------------------------------------------------------------
-# Declare some useful functions.
-
-
-def connect_db():
-    """Connects to the sqlite database."""
-
-    DB_FILENAME = Path(__file__).parent / "inventory.db"
-    db_already_exists = DB_FILENAME.exists()
-
-    conn = sqlite3.connect(DB_FILENAME)
-    db_was_just_created = not db_already_exists
 
-    return conn, db_was_just_created
-
-
-def initialize_data(conn):
-    """Initializes the inventory table with some data."""
-    cursor = conn.cursor()
-
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS inventory (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            item_name TEXT,
-            price REAL,
-            units_sold INTEGER,
-            units_left INTEGER,
-            cost_price REAL,
-            reorder_point INTEGER,
-            description TEXT
-        )
-        """
-    )
-
-    cursor.execute(
-        """
-        INSERT INTO inventory
-            (item_name, price, units_sold, units_left, cost_price, reorder_point, description)
-        VALUES
-            -- Beverages
-            ('Bottled Water (500ml)', 1.50, 115, 15, 0.80, 16, 'Hydrating bottled water'),
-            ('Soda (355ml)', 2.00, 93, 8, 1.20, 10, 'Carbonated soft drink'),
-            ('Energy Drink (250ml)', 2.50, 12, 18, 1.50, 8, 'High-caffeine energy drink'),
-            ('Coffee (hot, large)', 2.75, 11, 14, 1.80, 5, 'Freshly brewed hot coffee'),
-            ('Juice (200ml)', 2.25, 11, 9, 1.30, 5, 'Fruit juice blend'),
-
-            -- Snacks
-            ('Potato Chips (small)', 2.00, 34, 16, 1.00, 10, 'Salted and crispy potato chips'),
-            ('Candy Bar', 1.50, 6, 19, 0.80, 15, 'Chocolate and candy bar'),
-            ('Granola Bar', 2.25, 3, 12, 1.30, 8, 'Healthy and nutritious granola bar'),
-            ('Cookies (pack of 6)', 2.50, 8, 8, 1.50, 5, 'Soft and chewy cookies'),
-            ('Fruit Snack Pack', 1.75, 5, 10, 1.00, 8, 'Assortment of dried fruits and nuts'),
-
-            -- Personal Care
-            ('Toothpaste', 3.50, 1, 9, 2.00, 5, 'Minty toothpaste for oral hygiene'),
-            ('Hand Sanitizer (small)', 2.00, 2, 13, 1.20, 8, 'Small sanitizer bottle for on-the-go'),
-            ('Pain Relievers (pack)', 5.00, 1, 5, 3.00, 3, 'Over-the-counter pain relief medication'),
-            ('Bandages (box)', 3.00, 0, 10, 2.00, 5, 'Box of adhesive bandages for minor cuts'),
-            ('Sunscreen (small)', 5.50, 6, 5, 3.50, 3, 'Small bottle of sunscreen for sun protection'),
-
-            -- Household
-            ('Batteries (AA, pack of 4)', 4.00, 1, 5, 2.50, 3, 'Pack of 4 AA batteries'),
-            ('Light Bulbs (LED, 2-pack)', 6.00, 3, 3, 4.00, 2, 'Energy-efficient LED light bulbs'),
-            ('Trash Bags (small, 10-pack)', 3.00, 5, 10, 2.00, 5, 'Small trash bags for everyday use'),
-            ('Paper Towels (single roll)', 2.50, 3, 8, 1.50, 5, 'Single roll of paper towels'),
-            ('Multi-Surface Cleaner', 4.50, 2, 5, 3.00, 3, 'All-purpose cleaning spray'),
-
-            -- Others
-            ('Lottery Tickets', 2.00, 17, 20, 1.50, 10, 'Assorted lottery tickets'),
-            ('Newspaper', 1.50, 22, 20, 1.00, 5, 'Daily newspaper')
-        """
-    )
-    conn.commit()
-
-
-def load_data(conn):
-    """Loads the inventory data from the database."""
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute("SELECT * FROM inventory")
-        data = cursor.fetchall()
-    except:
-        return None
-
-    df = pd.DataFrame(
-        data,
-        columns=[
-            "id",
-            "item_name",
-            "price",
-            "units_sold",
-            "units_left",
-            "cost_price",
-            "reorder_point",
-            "description",
-        ],
-    )
+from utils.analytics import campaigns, sales_figures
+from utils.bulk import import_export_panel
+from utils.cache import rerun_on_change
+from utils.editing import (
+    PAGE_SIZES,
+    apply_pending,
+    commit_pending,
+    editor_changes,
+    editor_key,
+    has_pending_changes,
+    init_paging,
+    page_navigation,
+    restart_paging,
+    shown_pending,
+    write_status,
+)
+from utils.inventory import (
+    CHART_ROW_CAP,
+    DB_FILENAME,
+    chart_spec,
+    connect_db,
+    export_items,
+    import_items,
+    initialize_data,
+    load_low_stock,
+    load_page,
+    prepare_database,
+    write_changes,
+)
+from utils.profiling import profiled, show_profile, stage, start_profiling
 
-    return df
-
-
-def update_data(conn, df, changes):
-    """Updates the inventory data in the database."""
-    cursor = conn.cursor()
-
-    if changes["edited_rows"]:
-        deltas = st.session_state.inventory_table["edited_rows"]
-        rows = []
-
-        for i, delta in deltas.items():
-            row_dict = df.iloc[i].to_dict()
-            row_dict.update(delta)
-            rows.append(row_dict)
-
-        cursor.executemany(
-            """
-            UPDATE inventory
-            SET
-                item_name = :item_name,
-                price = :price,
-                units_sold = :units_sold,
-                units_left = :units_left,
-                cost_price = :cost_price,
-                reorder_point = :reorder_point,
-                description = :description
-            WHERE id = :id
-            """,
-            rows,
-        )
+# Columns the inventory table can be sorted on.
+SORT_COLUMNS = {
+    "id": "ID",
+    "item_name": "Item name",
+    "units_left": "Units left",
+    "units_sold": "Units sold",
+    "price": "Price",
+}
 
-    if changes["added_rows"]:
-        cursor.executemany(
-            """
-            INSERT INTO inventory
-                (id, item_name, price, units_sold, units_left, cost_price, reorder_point, description)
-            VALUES
-                (:id, :item_name, :price, :units_sold, :units_left, :cost_price, :reorder_point, :description)
-            """,
-            (defaultdict(lambda: None, row) for row in changes["added_rows"]),
-        )
+# -----------------------------------------------------------------------------
+# Declare some useful functions.
 
-    if changes["deleted_rows"]:
-        cursor.executemany(
-            "DELETE FROM inventory WHERE id = :id",
-            ({"id": int(df.loc[i, "id"])} for i in changes["deleted_rows"]),
-        )
 
-    conn.commit()
+def update_data():
+    """Queues the inventory changes to be written to the database."""
+    commit_pending("inventory", DB_FILENAME, write_changes)
 
 
 # -----------------------------------------------------------------------------
 # Draw the actual page, starting with the inventory table.
 
+start_profiling("Material")
+
 # Set the title that appears at the top of the page.
 """
 # :shopping_bags: Inventory tracker
@@ -177,41 +70,94 @@ st.info(
 )
 
 # Connect to database and create table if needed
-conn, db_was_just_created = connect_db()
-
-# Initialize data.
-if db_was_just_created:
-    initialize_data(conn)
-    st.toast("Database initialized with some sample data.")
-
-# Load data from database
-df = load_data(conn)
-
-# Display data with editable table
-edited_df = st.data_editor(
-    df,
-    disabled=["id"],  # Don't allow editing the 'id' column.
-    num_rows="dynamic",  # Allow appending/deleting rows.
-    column_config={
-        # Show dollar sign before price columns.
-        "price": st.column_config.NumberColumn(format="$%.2f"),
-        "cost_price": st.column_config.NumberColumn(format="$%.2f"),
-    },
-    key="inventory_table",
-)
+with stage("connect"):
+    conn, db_was_just_created = connect_db()
+
+    # Bring the schema up to date and initialize data.
+    prepare_database(conn)
+    if db_was_just_created:
+        initialize_data(conn)
+        st.toast("Database initialized with some sample data.")
+
+# Show the changes other people commit without them having to reload.
+rerun_on_change(conn, "inventory")
+
+# Only one page of items is loaded and shown in the editor at a time. Changes
+# are kept by item id until they are committed, so they survive turning pages.
+paging = init_paging("inventory")
+
+with st.expander("Import and export"):
+    import_export_panel(
+        "inventory", "items", conn, import_items, export_items, connect_db,
+        on_import=lambda: restart_paging("inventory"),
+    )
 
-has_uncommitted_changes = any(len(v) for v in st.session_state.inventory_table.values())
 
-st.button(
-    "Commit changes",
-    type="primary",
-    disabled=not has_uncommitted_changes,
-    # Update data in database
-    on_click=update_data,
-    args=(conn, df, st.session_state.inventory_table),
-)
+# Sorting, paging and editing only rerun the table. A saved commit reruns the
+# whole page, so the charts show it, see `write_status`.
+# Both fragments connect in their own reruns, see `utils.connection.connect`.
+@st.fragment
+@profiled("inventory table")
+def inventory_table():
+    """Shows a page of items in an editor, and the buttons to turn pages and commit."""
+    conn, _ = connect_db()
+    with st.expander("Sort and filter"):
+        search = st.text_input(
+            "Item name contains", key="inventory_search", on_change=restart_paging, args=("inventory",),
+        )
+        sort_column = st.selectbox(
+            "Sort by", list(SORT_COLUMNS), format_func=SORT_COLUMNS.get,
+            key="inventory_sort", on_change=restart_paging, args=("inventory",),
+        )
+        ascending = st.toggle(
+            "Ascending", value=True, key="inventory_ascending", on_change=restart_paging, args=("inventory",),
+        )
+        page_size = st.selectbox(
+            "Items per page", PAGE_SIZES, index=1,
+            key="inventory_page_size", on_change=restart_paging, args=("inventory",),
+        )
+
+    # Read the page when it is entered. It is then kept as is, because the editor's
+    # deltas refer to its row positions.
+    if paging["page_df"] is None:
+        with stage("load page"):
+            page_df, paging["next_cursor"] = load_page(
+                conn, search, sort_column, ascending, paging["cursors"][-1], page_size
+            )
+            paging["page_df"] = apply_pending(page_df, shown_pending(paging))
+
+    # Display data with editable table
+    with stage("editor"):
+        st.data_editor(
+            paging["page_df"],
+            disabled=["id"],  # Don't allow editing the 'id' column.
+            num_rows="dynamic",  # Allow appending/deleting rows.
+            column_config={
+                # Show dollar sign before price columns.
+                "price": st.column_config.NumberColumn(format="$%.2f"),
+                "cost_price": st.column_config.NumberColumn(format="$%.2f"),
+            },
+            key=editor_key("inventory"),
+        )
+
+    page_navigation("inventory")
+
+    has_uncommitted_changes = has_pending_changes(paging["pending"]) or any(
+        len(v) for v in editor_changes("inventory").values()
+    )
+
+    st.button(
+        "Commit changes",
+        type="primary",
+        disabled=not has_uncommitted_changes,
+        # Update data in database, in the background.
+        on_click=update_data,
+    )
+    write_status("inventory")
 
 
+inventory_table()
+
 # -----------------------------------------------------------------------------
 # Now some cool charts
 
@@ -220,63 +166,61 @@ st.button(
 ""
 ""
 
-st.subheader("Units left", divider="red")
 
-need_to_reorder = df[df["units_left"] < df["reorder_point"]].loc[:, "item_name"]
+# Changing the chart size only reruns the charts. They show the saved
+# inventory, so editing the table leaves them alone.
+@st.fragment
+@profiled("charts")
+def charts():
+    """Shows the items to reorder and the charts, at the size chosen."""
+    conn, _ = connect_db()
+    # The charts only get the first items and a sum of the others, so their size
+    # does not grow with the inventory.
+    chart_rows = st.number_input(
+        "Items per chart", min_value=5, max_value=200, value=CHART_ROW_CAP, step=5, key="inventory_chart_rows",
+    )
 
-if len(need_to_reorder) > 0:
-    items = "\n".join(f"* {name}" for name in need_to_reorder)
+    st.subheader("Units left", divider="red")
 
-    st.error(f"We're running dangerously low on the items below:\n {items}")
+    # The database keeps the items to reorder in an index of their own.
+    with stage("low stock"):
+        need_to_reorder = load_low_stock(conn)
 
-""
-""
+    if len(need_to_reorder) > 0:
+        items = "\n".join(f"* {name}" for name in need_to_reorder)
 
-st.altair_chart(
-    # Layer 1: Bar chart.
-    alt.Chart(df)
-    .mark_bar(
-        orient="horizontal",
-    )
-    .encode(
-        x="units_left",
-        y="item_name",
-    )
-    # Layer 2: Chart showing the reorder point.
-    + alt.Chart(df)
-    .mark_point(
-        shape="diamond",
-        filled=True,
-        size=50,
-        color="salmon",
-        opacity=1,
+        st.error(f"We're running dangerously low on the items below:\n {items}")
+
+    ""
+    ""
+
+    with stage("units left chart"):
+        st.vega_lite_chart(chart_spec(conn, "units_left", chart_rows), use_container_width=True)
+
+    st.caption(
+        "NOTE: The :diamonds: location shows the reorder point. "
+        "Items closest to their reorder point come first."
     )
-    .encode(
-        x="reorder_point",
-        y="item_name",
-    ),
-    use_container_width=True,
-)
 
-st.caption("NOTE: The :diamonds: location shows the reorder point.")
+    ""
+    ""
+    ""
 
-""
-""
-""
+    st.subheader("Best sellers", divider="orange")
 
-# -----------------------------------------------------------------------------
+    ""
+    ""
 
-st.subheader("Best sellers", divider="orange")
+    with stage("best sellers chart"):
+        st.vega_lite_chart(chart_spec(conn, "best_sellers", chart_rows), use_container_width=True)
 
-""
-""
 
-st.altair_chart(
-    alt.Chart(df)
-    .mark_bar(orient="horizontal")
-    .encode(
-        x="units_sold",
-        y=alt.Y("item_name").sort("-x"),
-    ),
-    use_container_width=True,
-)
+charts()
+
+# Sales in the archived campaigns, see the home page.
+if campaigns():
+    st.subheader("Campaigns", divider="gray")
+    with stage("campaign figures"):
+        st.dataframe(sales_figures(conn))
+
+show_profile()
@@ -0,0 +1,153 @@
+"""Checks of the tasks database: migrations, versioned writes, paging and facets.
+
+Every test works on a copy of the demo database, which still has the schema
+the first version of the app wrote, so the migrations run from the start.
+"""
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from utils import useful_functions as tasks
+from utils.cache import get_revision_cache
+from utils.connection import connect
+from utils.editing import keyset_page
+from utils.migrations import migrate, schema_version
+
+LEGACY_DB = Path(__file__).parent.parent / "tasks_demo.db"
+
+
+@pytest.fixture
+def conn(tmp_path):
+    path = tmp_path / "tasks.db"
+    shutil.copy(LEGACY_DB, path)
+    conn, _ = connect(path)
+    tasks.prepare_database(conn)
+    return conn
+
+
+def _task(**values):
+    task = {
+        "description": "A task",
+        "sub_system": "HV",
+        "status": "Not Started",
+        "priority": "Low",
+        "submission_date": pd.Timestamp("2025-03-01"),
+        "duration": 1,
+        "contact_person": "Marion",
+    }
+    return {**task, **values}
+
+
+def _version(conn, task_id):
+    return conn.execute("SELECT version FROM tasks WHERE id = ?", (task_id,)).fetchone()[0]
+
+
+def test_migrations_upgrade_the_legacy_database(conn):
+    assert schema_version(conn) == len(tasks.TASK_MIGRATIONS)
+    assert not migrate(conn, tasks.TASK_MIGRATIONS)
+
+    df = tasks.load_data(conn)
+    assert sorted(df["id"]) == list(range(1, 9))
+    # Mixed-case statuses, REAL durations and timestamp strings are normalized.
+    assert set(df["status"]) == {"Not Started", "In Progress"}
+    assert df["duration"].dtype == "Int64"
+    assert df.loc[df["id"] == 4, "duration"].item() == 2
+    assert df.loc[df["id"] == 4, "submission_date"].item() == pd.Timestamp("2025-02-28")
+    assert (conn.execute("SELECT DISTINCT typeof(submission_date) FROM tasks").fetchall()) == [("integer",)]
+
+    # The full-text index covers the tasks already there.
+    found = tasks.query_tasks(conn, {}, search="organisation")
+    assert list(found["id"]) == [4]
+
+
+def test_write_changes_only_overwrites_the_version_read(conn):
+    task = tasks.query_tasks(conn, {"id": [1]}).to_dict("records")[0]
+    assert tasks.commit_changes(conn, [{**task, "duration": 11}], []) == []
+    assert _version(conn, 1) == task["version"] + 1
+
+    # The same row, still at the version first read, is now stale.
+    conflicts = tasks.commit_changes(conn, [{**task, "duration": 12}], [])
+    assert [c["id"] for c in conflicts] == [1]
+    assert conflicts[0]["mine"]["duration"] == 12
+    assert conflicts[0]["theirs"]["duration"] == 11
+    assert conflicts[0]["theirs"]["version"] == task["version"] + 1
+
+    conflicts = tasks.commit_changes(conn, [], {1: task["version"]})
+    assert [(c["id"], c["mine"]) for c in conflicts] == [(1, None)]
+    assert tasks.commit_changes(conn, [], {1: task["version"] + 1}) == []
+    # Deleting a task someone else deleted too is no conflict.
+    assert tasks.commit_changes(conn, [], {1: task["version"] + 1}) == []
+
+
+@pytest.mark.filterwarnings("error")
+def test_updated_frame_matches_a_full_read(conn):
+    tasks.load_data(conn)
+    # Michal and LV lose their last tasks, Zoe and a new sub-system come in.
+    gone = [
+        row_id for row_id, in conn.execute(
+            "SELECT id FROM tasks WHERE contact_person = 'Michal' OR sub_system = 'LV'"
+        )
+    ]
+    tasks.commit_changes(conn, [_task(contact_person="Zoe", sub_system="Magnet")], gone)
+
+    updates = get_revision_cache().stats["updates"]
+    df = tasks.load_data(conn)
+    assert get_revision_cache().stats["updates"] == updates + 1
+    pd.testing.assert_frame_equal(df, tasks.read_tasks(conn))
+
+
+@pytest.mark.parametrize("sort_column", ["id", "duration", "contact_person", "submission_date"])
+@pytest.mark.parametrize("ascending", [True, False])
+def test_keyset_pages_match_offset_pages(conn, sort_column, ascending):
+    # Repeated and missing sort keys are where seeking goes wrong.
+    tasks.commit_changes(
+        conn,
+        [
+            _task(duration=None if i % 3 == 0 else i % 4, contact_person=None if i % 5 == 0 else f"P{i % 2}")
+            for i in range(20)
+        ],
+        [],
+    )
+    columns = tasks.STORED_TASK_COLUMNS
+    direction = "ASC" if ascending else "DESC"
+    order = "id" if sort_column == "id" else f"{sort_column} {direction}, id"
+
+    cursor, offset = None, 0
+    while True:
+        rows, cursor = keyset_page(conn, "tasks", columns, sort_column, ascending, cursor, page_size=7)
+        expected = conn.execute(
+            f"SELECT {', '.join(columns)} FROM tasks ORDER BY {order} {direction} LIMIT 7 OFFSET ?",
+            (offset,),
+        ).fetchall()
+        assert rows == expected
+        offset += len(rows)
+        if cursor is None:
+            break
+    assert offset == conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+
+def test_facets_follow_every_write(conn):
+    tasks.commit_changes(conn, [_task(contact_person="Zoe", sub_system="MCP")], [])
+    zoe_id = conn.execute("SELECT id FROM tasks WHERE contact_person = 'Zoe'").fetchone()[0]
+    task = tasks.query_tasks(conn, {"id": [2]}).to_dict("records")[0]
+    tasks.commit_changes(conn, [{**task, "status": "Done", "priority": None}], [3])
+    _check_facets(conn)
+    assert tasks.load_filter_options(conn)["counts"]["contact_person"]["Zoe"] == 1
+
+    # A value no task has any more is dropped.
+    tasks.commit_changes(conn, [], [zoe_id])
+    _check_facets(conn)
+    assert "Zoe" not in tasks.load_filter_options(conn)["contact_person"]
+
+
+def _check_facets(conn):
+    for column in tasks.FACET_COLUMNS:
+        expected = conn.execute(
+            f"SELECT {column}, COUNT(*) FROM tasks WHERE {column} IS NOT NULL GROUP BY {column}"
+        ).fetchall()
+        facets = conn.execute(
+            "SELECT value, count FROM task_facets WHERE column_name = ? ORDER BY value", (column,)
+        ).fetchall()
+        assert facets == sorted(expected)
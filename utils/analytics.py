@@ -0,0 +1,210 @@
+"""Figures across campaigns: the current one in SQLite, past ones in Parquet.
+
+SQLite stays the store the pages read and edit. When a campaign is over, its
+tasks and inventory are archived as Parquet snapshots, see `archive_campaign`,
+and the figures comparing campaigns aggregate every archived row. DuckDB
+computes them when it is installed (`pip install duckdb`). Otherwise pyarrow
+does. Both read only the columns a figure needs.
+
+Snapshots are laid out as `archive/<table>/campaign=<name>/data.parquet`, so
+both engines read the campaign name from the path.
+"""
+import re
+import shutil
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+
+from utils import inventory
+from utils import useful_functions as tasks
+from utils.cache import data_revision, get_revision_cache
+
+ARCHIVE_DIR = Path(__file__).parent.parent / "archive"
+
+# Name of the campaign in the live databases, in the figures.
+CURRENT_CAMPAIGN = "Current"
+
+# Names campaigns can be archived under. They end up in paths.
+CAMPAIGN_NAME = re.compile(r"\w[\w .-]*")
+
+# table -> function returning all its rows as a file, see `utils.bulk`
+SNAPSHOTS = {
+    "tasks": tasks.export_tasks,
+    "inventory": inventory.export_items,
+}
+
+
+# -----------------------------------------------------------------------------
+# Archives.
+
+
+def archive_campaign(name, tasks_conn, inventory_conn, archive_dir=ARCHIVE_DIR):
+    """Saves the tasks and the inventory as the snapshots of campaign `name`.
+
+    The snapshots are written to a temporary directory and only moved into
+    place once both are written, so a campaign is archived whole or not at all.
+    """
+    if not CAMPAIGN_NAME.fullmatch(name) or name.strip() != name:
+        raise ValueError(f"{name!r} is not a campaign name: use letters, digits, spaces, '.', '-' and '_'.")
+    if name == CURRENT_CAMPAIGN or name in campaigns(archive_dir):
+        raise ValueError(f"There already is a campaign called {name!r}.")
+    # Such as the leftovers of a campaign archived by hand.
+    targets = {table: _snapshot_path(archive_dir, table, name).parent for table in SNAPSHOTS}
+    for target in targets.values():
+        if target.exists():
+            raise ValueError(f"{target} already exists: move it away to archive a campaign called {name!r}.")
+
+    # In the archive directory, so that moving the snapshots is only a rename.
+    Path(archive_dir).mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix=".archiving-", dir=archive_dir) as staging:
+        for table, conn in (("tasks", tasks_conn), ("inventory", inventory_conn)):
+            path = _snapshot_path(staging, table, name)
+            path.parent.mkdir(parents=True)
+            path.write_bytes(SNAPSHOTS[table](conn, "parquet"))
+
+        moved = []
+        try:
+            for table, target in targets.items():
+                target.parent.mkdir(exist_ok=True)
+                _snapshot_path(staging, table, name).parent.rename(target)
+                moved.append(target)
+        except OSError:
+            for target in moved:
+                shutil.rmtree(target)
+            raise
+
+
+def campaigns(archive_dir=ARCHIVE_DIR):
+    """Returns the names of the archived campaigns, sorted."""
+    return sorted(path.parent.name.removeprefix("campaign=") for path in _snapshots(archive_dir, "tasks"))
+
+
+def _snapshot_path(archive_dir, table, name):
+    return Path(archive_dir) / table / f"campaign={name}" / "data.parquet"
+
+
+def _snapshots(archive_dir, table):
+    return sorted((Path(archive_dir) / table).glob("campaign=*/data.parquet"))
+
+
+def _archive_version(archive_dir):
+    """Changes whenever a snapshot is added, removed or rewritten."""
+    return tuple(
+        (str(path), path.stat().st_mtime_ns) for table in SNAPSHOTS for path in _snapshots(archive_dir, table)
+    )
+
+
+# -----------------------------------------------------------------------------
+# Aggregations over the snapshots.
+
+
+def load_duckdb():
+    """Returns the duckdb module, or None when it is not installed."""
+    try:
+        import duckdb  # Optional, and slow to import: only when figures are computed.
+    except ImportError:
+        return None
+    return duckdb
+
+
+def aggregate_snapshots(table, by, sums, archive_dir=ARCHIVE_DIR):
+    """Returns the number of rows and the sums of columns `sums`, per campaign and `by`.
+
+    The frame has the columns campaign, *by, rows and *sums, sorted by the
+    first ones.
+    """
+    paths = _snapshots(archive_dir, table)
+    keys = ["campaign", *by]
+    if not paths:
+        return pd.DataFrame(columns=[*keys, "rows", *sums])
+
+    duckdb = load_duckdb()
+    if duckdb is not None:
+        df = _aggregate_duckdb(duckdb, paths, keys, sums)
+    else:
+        df = _aggregate_arrow(Path(archive_dir) / table, paths, keys, sums)
+    df = df.astype({"rows": "int64", **{c: "float64" for c in sums}})
+    return df.sort_values(keys, ignore_index=True)
+
+
+def _aggregate_duckdb(duckdb, paths, keys, sums):
+    select = [*keys, 'COUNT(*) AS "rows"', *(f'SUM("{c}") AS "{c}"' for c in sums)]
+    sql = f"""
+        SELECT {", ".join(select)}
+        FROM read_parquet(?, hive_partitioning = true, hive_types = {{'campaign': VARCHAR}})
+        GROUP BY {", ".join(keys)}
+    """
+    with duckdb.connect() as con:
+        return con.execute(sql, [[str(path) for path in paths]]).df()
+
+
+def _aggregate_arrow(directory, paths, keys, sums):
+    import pyarrow.dataset as ds  # Only needed without DuckDB.
+
+    dataset = ds.dataset(
+        [str(path) for path in paths],
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([("campaign", pa.string())]), flavor="hive"),
+        partition_base_dir=str(directory),
+    )
+    table = dataset.to_table(columns=[*keys, *sums])
+    grouped = table.group_by(keys).aggregate([([], "count_all"), *((c, "sum") for c in sums)])
+    return grouped.to_pandas().rename(columns={"count_all": "rows", **{f"{c}_sum": c for c in sums}})
+
+
+# -----------------------------------------------------------------------------
+# Figures shown on the pages, the current campaign last.
+
+
+def task_figures(conn, archive_dir=ARCHIVE_DIR):
+    """Returns the number of tasks of each status and the days of work, per campaign.
+
+    The current counts come from the facets the database keeps, see
+    `load_filter_options`, so only the days of work read the tasks. Figures
+    are cached until the tasks or the archives change.
+    """
+    key = (getattr(conn, "db_filename", None), "task_figures", str(archive_dir))
+    revision = (data_revision(conn, "tasks"), _archive_version(archive_dir))
+
+    cache = get_revision_cache()
+    df = cache.get(key, revision)
+    if df is None:
+        archived = aggregate_snapshots("tasks", ["status"], ["duration"], archive_dir)
+        figures = {
+            campaign: {**dict(zip(group["status"], group["rows"])), "Days of work": group["duration"].sum()}
+            for campaign, group in archived.groupby("campaign", sort=False)
+        }
+        (days,) = conn.execute("SELECT IFNULL(SUM(duration), 0) FROM tasks").fetchone()
+        figures[CURRENT_CAMPAIGN] = {**tasks.load_filter_options(conn)["counts"]["status"], "Days of work": days}
+
+        df = pd.DataFrame.from_dict(figures, orient="index", columns=[*tasks.STATUSES, "Days of work"])
+        df = df.fillna(0).astype("int64").rename_axis("campaign")
+        cache.put(key, revision, df)
+
+    return df
+
+
+def sales_figures(conn, archive_dir=ARCHIVE_DIR):
+    """Returns the number of items and the units sold and left, per campaign.
+
+    Figures are cached until the inventory or the archives change.
+    """
+    key = (getattr(conn, "db_filename", None), "sales_figures", str(archive_dir))
+    revision = (data_revision(conn, "inventory"), _archive_version(archive_dir))
+
+    cache = get_revision_cache()
+    df = cache.get(key, revision)
+    if df is None:
+        archived = aggregate_snapshots("inventory", [], ["units_sold", "units_left"], archive_dir)
+        figures = dict(zip(archived["campaign"], archived[["rows", "units_sold", "units_left"]].values.tolist()))
+        figures[CURRENT_CAMPAIGN] = conn.execute(
+            "SELECT COUNT(*), IFNULL(SUM(units_sold), 0), IFNULL(SUM(units_left), 0) FROM inventory"
+        ).fetchone()
+
+        df = pd.DataFrame.from_dict(figures, orient="index", columns=["Items", "Units sold", "Units left"])
+        df = df.astype("int64").rename_axis("campaign")
+        cache.put(key, revision, df)
+
+    return df
@@ -0,0 +1,184 @@
+import io
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import streamlit as st
+
+# Rows read, inserted or written at a time.
+CHUNK_SIZE = 10_000
+
+# Gives the string columns of `read_frame` their Arrow-backed dtype. pandas
+# picks it by default from version 3 on, earlier versions have to ask for it.
+ARROW_STRINGS = None if int(pd.__version__.split(".")[0]) >= 3 else {pa.string(): pd.StringDtype("pyarrow")}.get
+
+# Export formats and their MIME types.
+FORMATS = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def read_chunks(file, chunk_size=CHUNK_SIZE):
+    """Yields the rows of a CSV or Parquet file as frames of `chunk_size` rows.
+
+    `file` is a path or a file object with a `name`, like Streamlit's uploaded
+    files. The format follows the file extension.
+    """
+    name = getattr(file, "name", str(file))
+    extension = Path(name).suffix.lower()
+    if extension == ".csv":
+        with pd.read_csv(file, chunksize=chunk_size) as reader:
+            yield from reader
+    elif extension == ".parquet":
+        import pyarrow.parquet as pq  # Only imported once a Parquet file comes along.
+
+        for batch in pq.ParquetFile(file).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Cannot read {name}: expected a .csv or .parquet file")
+
+
+def import_chunks(conn, table, columns, chunks, encode, required=(), on_progress=None):
+    """Inserts the rows of `chunks` into `table`, all in one transaction.
+
+    `encode` turns a row of the file into the values of `columns`, raising
+    ValueError for an invalid row. Files must have the `required` columns.
+    Nothing is inserted if any row is invalid. `on_progress` is called with
+    the number of rows inserted so far after each chunk. Returns that number.
+    """
+    sql = (
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"VALUES ({', '.join(':' + column for column in columns)})"
+    )
+    imported = 0
+    with conn:
+        for chunk in chunks:
+            missing = [column for column in required if column not in chunk.columns]
+            if missing:
+                raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+            rows = []
+            for i, row in enumerate(chunk.to_dict("records"), start=imported + 1):
+                try:
+                    rows.append(encode(row))
+                except (TypeError, ValueError) as error:
+                    raise ValueError(f"Row {i}: {error}") from None
+            conn.executemany(sql, rows)
+
+            imported += len(rows)
+            if on_progress is not None:
+                on_progress(imported)
+    return imported
+
+
+def export_chunks(conn, sql, columns, decode=None, chunk_size=CHUNK_SIZE):
+    """Yields the result of `sql` as frames of `chunk_size` rows.
+
+    `decode` is applied to each frame. An empty result gives one empty frame,
+    so that the exported file still has its columns.
+    """
+    cursor = conn.execute(sql)
+    empty = True
+    while rows := cursor.fetchmany(chunk_size):
+        empty = False
+        df = pd.DataFrame(rows, columns=columns)
+        yield df if decode is None else decode(df)
+    if empty:
+        df = pd.DataFrame([], columns=columns)
+        yield df if decode is None else decode(df)
+
+
+def read_frame(conn, sql, params=(), types=None, chunk_size=CHUNK_SIZE, arrow=True):
+    """Returns the result of `sql` as a frame, read a chunk at a time into Arrow.
+
+    `types` maps each column of the result to an Arrow type name, like "int64"
+    or "string". Rows never pile up as Python tuples beyond one chunk, and the
+    string columns come out Arrow-backed, so Streamlit sends them to the
+    browser without converting them again. SQLite lets any column hold any
+    value: if one does not fit its type, the frame is built from the rows,
+    as it always is with `arrow=False`.
+    """
+    if not arrow:
+        return pd.DataFrame(conn.execute(sql, params).fetchall(), columns=list(types))
+
+    schema = pa.schema([(name, pa.type_for_alias(type_name)) for name, type_name in types.items()])
+    cursor = conn.execute(sql, params)
+    batches = []
+    try:
+        while rows := cursor.fetchmany(chunk_size):
+            columns = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            batches.append(pa.record_batch(columns, schema=schema))
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        return read_frame(conn, sql, params, types, arrow=False)
+    return pa.Table.from_batches(batches, schema=schema).to_pandas(types_mapper=ARROW_STRINGS)
+
+
+def write_chunks(chunks, output, fmt):
+    """Writes frames to a binary file object as one CSV or Parquet file."""
+    if fmt == "csv":
+        for i, df in enumerate(chunks):
+            output.write(df.to_csv(index=False, header=i == 0).encode())
+    elif fmt == "parquet":
+        import pyarrow.parquet as pq  # See `read_chunks`.
+
+        writer = None
+        for df in chunks:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(output, table.schema)
+            else:
+                # A chunk with only empty values in a column types it as null.
+                table = table.cast(writer.schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+    else:
+        raise ValueError(f"Unknown export format {fmt!r}, expected one of {list(FORMATS)}")
+
+
+def export_bytes(chunks, fmt):
+    """Returns frames written as one CSV or Parquet file."""
+    output = io.BytesIO()
+    write_chunks(chunks, output, fmt)
+    return output.getvalue()
+
+
+def import_export_panel(name, noun, conn, import_rows, export_rows, connect_db, on_import=None):
+    """Shows an upload to import rows from a file and buttons to export them all.
+
+    `import_rows(conn, chunks, on_progress)` and `export_rows(conn, fmt)` do
+    the work, `on_import` is called after a successful import. Exports are
+    only built when a button is clicked, and may run outside the script
+    thread, so they get their own connection from `connect_db`.
+    """
+    upload = st.file_uploader(
+        f"Import {noun} from a CSV or Parquet file", type=["csv", "parquet"], key=f"{name}_import_file",
+    )
+    if upload is not None and st.button(f"Import {upload.name}", key=f"{name}_import"):
+        progress = st.progress(0.0, text=f"Importing {noun}...")
+
+        def report(count):
+            done = min(upload.tell() / max(upload.size, 1), 1.0)
+            progress.progress(done, text=f"{count} {noun} imported")
+
+        try:
+            count = import_rows(conn, read_chunks(upload), on_progress=report)
+        except ValueError as error:
+            progress.empty()
+            st.error(f"Nothing was imported. {error}")
+        else:
+            progress.progress(1.0, text=f"{count} {noun} imported")
+            st.toast(f"{count} {noun} imported!")
+            if on_import is not None:
+                on_import()
+
+    for column, (fmt, mime) in zip(st.columns(len(FORMATS)), FORMATS.items()):
+        column.download_button(
+            f"Export as {fmt.upper()}",
+            data=lambda fmt=fmt: export_rows(connect_db()[0], fmt),
+            file_name=f"{name}.{fmt}",
+            mime=mime,
+            key=f"{name}_export_{fmt}",
+            on_click="ignore",
+        )
@@ -0,0 +1,245 @@
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.connection import connect
+
+# Whether pandas copies on write, which it always does from version 3 on.
+# Earlier versions are left as they are: the option changes them for the
+# whole process. See `shared_view`.
+COPY_ON_WRITE = int(pd.__version__.split(".")[0]) >= 3
+
+# Bytes the shared cache may take before it drops the values least recently
+# used. The frame of all tasks is one of them, see `load_data`.
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+# Seconds between two checks for changes made by other sessions.
+CHANGE_POLL_INTERVAL = 5
+
+# Bumped by triggers on every write to a tracked table, see `track_revisions`.
+#
+# `PRAGMA data_version` is not enough here: it only changes for commits made
+# through *other* connections and its value means nothing outside the
+# connection that read it, while our caches are shared by every connection.
+REVISION_TABLE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS data_revision (
+        table_name TEXT PRIMARY KEY,
+        revision INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+
+def track_revisions(conn, table):
+    """Installs the triggers that bump the revision of `table` on every write.
+
+    Runs inside the caller's transaction, typically a migration.
+    """
+    conn.execute(REVISION_TABLE_SCHEMA)
+    conn.execute("INSERT OR IGNORE INTO data_revision (table_name) VALUES (?)", (table,))
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_revision_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE data_revision SET revision = revision + 1
+                WHERE table_name = '{table}';
+            END
+            """
+        )
+
+
+# The revision at which each row of a tracked table was last written, see
+# `track_changes`. A row's entry is replaced on every write, so the log never
+# grows past one entry per row ever stored.
+CHANGE_LOG_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS change_log (
+        table_name TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        revision INTEGER NOT NULL,
+        PRIMARY KEY (table_name, row_id)
+    ) WITHOUT ROWID
+"""
+
+
+def track_changes(conn, table):
+    """Replaces the triggers of `track_revisions` by ones that also log rows.
+
+    Each write bumps the revision of `table` and records it against the id of
+    the row, see `changed_since`. Runs inside the caller's transaction,
+    typically a migration.
+    """
+    conn.execute(CHANGE_LOG_SCHEMA)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS change_log_revision ON change_log (table_name, revision)"
+    )
+    # An update logs the old id too, in case the id itself was changed.
+    for event, rows in (("INSERT", ["new"]), ("UPDATE", ["old", "new"]), ("DELETE", ["old"])):
+        conn.execute(f"DROP TRIGGER IF EXISTS {table}_revision_{event.lower()}")
+        log_rows = "".join(
+            f"""
+                INSERT OR REPLACE INTO change_log (table_name, row_id, revision)
+                SELECT table_name, {row}.id, revision FROM data_revision
+                WHERE table_name = '{table}';"""
+            for row in rows
+        )
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_changes_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE data_revision SET revision = revision + 1
+                WHERE table_name = '{table}';{log_rows}
+            END
+            """
+        )
+
+
+def changed_since(conn, table, revision):
+    """Returns the ids of the rows of `table` written after `revision`.
+
+    Deleted rows are included: they are the ids no longer in the table.
+    """
+    return [
+        row_id for row_id, in conn.execute(
+            "SELECT row_id FROM change_log WHERE table_name = ? AND revision > ?",
+            (table, revision),
+        )
+    ]
+
+
+def data_revision(conn, table):
+    """Returns the current revision of `table`, or None if it is not tracked."""
+    try:
+        row = conn.execute(
+            "SELECT revision FROM data_revision WHERE table_name = ?", (table,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return None if row is None else row[0]
+
+
+class RevisionCache:
+    """Keeps one value per key, valid as long as its data revision is unchanged.
+
+    Keys start with the database file and the kind of value, e.g.
+    `(db_filename, "query", sql, params)`. Caching a value drops the values of
+    the same kind cached at another revision, which can no longer be hit. The
+    values least recently used are dropped once they take more than
+    `max_bytes` together.
+    """
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (revision, value, size), least recently used first
+        self._size = 0
+        self.stats = {"hits": 0, "misses": 0, "updates": 0, "evictions": 0}
+
+    def get(self, key, revision):
+        """Returns the value cached for `key` at `revision`, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if revision is not None and entry is not None and entry[0] == revision:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1]
+            self.stats["misses"] += 1
+            return None
+
+    def latest(self, key):
+        """Returns `(revision, value)` last cached for `key`, however old, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else entry[:2]
+
+    def put(self, key, revision, value):
+        size = _size_of(value)
+        with self._lock:
+            stale = [
+                other for other, entry in self._entries.items()
+                if other[:2] == key[:2] and entry[0] != revision
+            ]
+            for other in stale:
+                self._drop(other)
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (revision, value, size)
+            self._size += size
+            # The value just cached stays, however big.
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                self._drop(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+    def size(self):
+        """Returns the bytes the cached values take, as far as they are known."""
+        with self._lock:
+            return self._size
+
+    def _drop(self, key):
+        self._size -= self._entries.pop(key)[2]
+
+    def count_update(self):
+        """Counts a value brought up to date from an older one instead of rebuilt."""
+        with self._lock:
+            self.stats["updates"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+def _size_of(value):
+    """Returns about how many bytes a cached value takes."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+def shared_view(df):
+    """Returns a frame sharing the data of a cached frame, free to modify.
+
+    With copy-on-write, changes to the view copy only the columns they touch
+    and never reach the cached frame. Every session can then work from the one
+    snapshot in the cache, and only pays memory for what it changes. Without
+    it, the view is a full copy.
+    """
+    return df.copy(deep=not COPY_ON_WRITE)
+
+
+@st.cache_resource
+def get_revision_cache():
+    """Returns the cache shared by all sessions of the app."""
+    return RevisionCache()
+
+
+def cache_stats():
+    """Returns the hit and miss counts of the shared cache."""
+    return dict(get_revision_cache().stats)
+
+
+def rerun_on_change(conn, table, interval=CHANGE_POLL_INTERVAL):
+    """Reruns the app when `table` changes, checking every `interval` seconds.
+
+    Call it before the page reads the data, so that no change is missed. A
+    check is a single lookup of the revision, so staying fresh costs nothing
+    while no one writes, and the caches only reload what changed when someone
+    does.
+    """
+    st.fragment(_rerun_on_change, run_every=interval)(
+        conn.db_filename, table, data_revision(conn, table)
+    )
+
+
+def _rerun_on_change(db_filename, table, shown_revision):
+    conn, _ = connect(db_filename)
+    if data_revision(conn, table) != shown_revision:
+        st.rerun()
@@ -0,0 +1,156 @@
+import sqlite3
+import threading
+from pathlib import Path
+
+import streamlit as st
+
+from utils.profiling import ProfilingCursor, current_profiler
+
+# Applied to every connection we open. WAL lets readers carry on while a
+# writer commits, which is what several people editing at once need.
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # Safe with WAL, and much cheaper than FULL.
+    "busy_timeout": 5000,  # ms to wait on a locked database before failing.
+    "cache_size": -16000,  # Negative means KiB, so 16 MB of page cache.
+    "temp_store": "MEMORY",
+    "mmap_size": 64 * 1024 * 1024,
+    "foreign_keys": "ON",
+}
+
+# Connections kept around for threads that have not asked for one yet.
+MAX_IDLE_CONNECTIONS = 8
+
+
+class Connection(sqlite3.Connection):
+    """A sqlite3 connection that remembers which database file it is for.
+
+    Its cursors time their queries while a rerun is profiled, see
+    `utils.profiling`.
+    """
+
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        self.db_filename = str(database)
+
+    def cursor(self, factory=None):
+        profiler = current_profiler()
+        if factory is None and profiler is not None:
+            return ProfilingCursor(self, profiler)
+        return super().cursor() if factory is None else super().cursor(factory)
+
+    # sqlite3's shortcuts make their cursor without calling `cursor`, so they
+    # are routed through it while profiling.
+
+    def execute(self, *args):
+        if current_profiler() is None:
+            return super().execute(*args)
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        if current_profiler() is None:
+            return super().executemany(*args)
+        return self.cursor().executemany(*args)
+
+    def executescript(self, *args):
+        if current_profiler() is None:
+            return super().executescript(*args)
+        return self.cursor().executescript(*args)
+
+
+class ConnectionManager:
+    """Hands out one SQLite connection per thread for a database file.
+
+    Streamlit runs each script run on its own thread, so a connection is never
+    shared between two live threads. Connections of finished threads are
+    handed to the next thread asking for one instead of being closed.
+    """
+
+    def __init__(self, db_filename, pragmas=None):
+        self.db_filename = Path(db_filename)
+        self.pragmas = PRAGMAS if pragmas is None else pragmas
+        self._needs_initialization = not self.db_filename.exists()
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._idle = []
+        self.stats = {"opened": 0, "reused": 0, "recycled": 0, "closed": 0}
+
+    def connect(self):
+        """Returns `(conn, db_was_just_created)` for the calling thread.
+
+        `db_was_just_created` is True only for the first connection made to a
+        database file that did not exist yet.
+        """
+        thread = threading.current_thread()
+
+        with self._lock:
+            db_was_just_created = self._needs_initialization
+            self._needs_initialization = False
+
+            conn = self._connections.get(thread)
+            if conn is not None:
+                self.stats["reused"] += 1
+                return conn, db_was_just_created
+
+            self._reclaim_dead_threads()
+            if self._idle:
+                conn = self._idle.pop()
+                self.stats["recycled"] += 1
+            else:
+                conn = self._open()
+                self.stats["opened"] += 1
+            self._connections[thread] = conn
+
+        return conn, db_was_just_created
+
+    def close_all(self):
+        """Closes every connection, e.g. before deleting the database file."""
+        with self._lock:
+            for conn in [*self._connections.values(), *self._idle]:
+                conn.close()
+                self.stats["closed"] += 1
+            self._connections.clear()
+            self._idle.clear()
+
+    def _open(self):
+        # The connection may move to another thread once its owner is gone,
+        # see `_reclaim_dead_threads`, so sqlite3's same-thread check is off.
+        conn = sqlite3.connect(
+            self.db_filename, check_same_thread=False, factory=Connection
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _reclaim_dead_threads(self):
+        for thread in [t for t in self._connections if not t.is_alive()]:
+            conn = self._connections.pop(thread)
+            if conn.in_transaction:
+                conn.rollback()
+            if len(self._idle) < MAX_IDLE_CONNECTIONS:
+                self._idle.append(conn)
+            else:
+                conn.close()
+                self.stats["closed"] += 1
+
+
+@st.cache_resource
+def get_connection_manager(db_filename):
+    """Returns the process-wide connection manager for a database file."""
+    return ConnectionManager(db_filename)
+
+
+def connect(db_filename):
+    """Connects to a sqlite database through its shared connection manager.
+
+    The connection belongs to the calling thread. Streamlit reruns fragments
+    on threads of their own, so fragments connect in their body instead of
+    using the connection of the full run, which may be handed to another
+    thread, and rolled back, once that run is over.
+    """
+    return get_connection_manager(str(Path(db_filename).resolve())).connect()
+
+
+def connection_stats(db_filename):
+    """Returns how often connections to a database were opened and reused."""
+    return dict(get_connection_manager(str(Path(db_filename).resolve())).stats)
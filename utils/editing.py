@@ -0,0 +1,448 @@
+import pandas as pd
+import streamlit as st
+
+from utils.writer import submit_write
+
+PAGE_SIZES = [25, 50, 100, 250]
+
+# Seconds between two checks of the commits still being written.
+WRITE_POLL_INTERVAL = 0.5
+
+# -----------------------------------------------------------------------------
+# Keyset pagination.
+
+
+def keyset_page(conn, table, columns, sort_column="id", ascending=True, after=None, page_size=50, where="", params=()):
+    """Fetches one page of `table`, ordered by `sort_column` and then `id`.
+
+    `after` is the cursor returned for the previous page, None for the first
+    one. Seeking from the cursor instead of using OFFSET makes every page cost
+    the same however deep into the table it is. `where` is an optional SQL
+    condition with its `params`. Returns the rows and the cursor of the next
+    page, which is None on the last page.
+    """
+    if sort_column not in columns:
+        raise ValueError(f"Cannot sort on unknown column {sort_column!r}")
+
+    clauses = [f"({where})"] if where else []
+    params = list(params)
+    if after is not None:
+        clause, seek_params = _seek_clause(sort_column, ascending, *after)
+        clauses.append(clause)
+        params.extend(seek_params)
+
+    direction = "ASC" if ascending else "DESC"
+    order = "id" if sort_column == "id" else f"{sort_column} {direction}, id"
+    sql = f"SELECT {', '.join(columns)} FROM {table}"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += f" ORDER BY {order} {direction} LIMIT ?"
+
+    # One extra row tells whether there is a next page.
+    rows = conn.execute(sql, [*params, page_size + 1]).fetchall()
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, (rows[-1][columns.index(sort_column)], rows[-1][columns.index("id")])
+
+
+def _seek_clause(sort_column, ascending, value, row_id):
+    """Returns the condition selecting the rows after `(value, row_id)`.
+
+    SQLite sorts NULLs first, so they come before any value in ascending
+    order and after every value in descending order.
+    """
+    if sort_column == "id":
+        return ("id > ?" if ascending else "id < ?"), [row_id]
+    if ascending:
+        if value is None:
+            return f"(({sort_column} IS NULL AND id > ?) OR {sort_column} IS NOT NULL)", [row_id]
+        return f"({sort_column} > ? OR ({sort_column} = ? AND id > ?))", [value, value, row_id]
+    if value is None:
+        return f"({sort_column} IS NULL AND id < ?)", [row_id]
+    return f"({sort_column} < ? OR ({sort_column} = ? AND id < ?) OR {sort_column} IS NULL)", [value, value, row_id]
+
+
+# -----------------------------------------------------------------------------
+# Pending changes, tracked by row id so they survive turning pages.
+
+
+def new_pending():
+    """Returns an empty set of pending changes.
+
+    `edited` maps row ids to the full edited row, `added` maps provisional ids
+    of rows not in the database yet to the row, and `deleted` maps the ids of
+    rows to delete to the `version` they were read at, if they have one.
+    Provisional ids count down from -1 so they never collide with ids the
+    database hands out.
+    """
+    return {"edited": {}, "added": {}, "deleted": {}, "next_id": -1}
+
+
+def has_pending_changes(pending):
+    return bool(pending["edited"] or pending["added"] or pending["deleted"])
+
+
+def add_rows(pending, rows):
+    """Adds new rows to `pending`, giving each a provisional id."""
+    for row in rows:
+        row_id = pending["next_id"]
+        pending["added"][row_id] = {**row, "id": row_id}
+        pending["next_id"] -= 1
+
+
+def fold_editor_changes(pending, df, changes):
+    """Moves the deltas of a `st.data_editor` widget into `pending`.
+
+    `df` is the frame the editor was given and `changes` its widget state,
+    whose row positions only make sense for that frame.
+    """
+    for i, delta in changes["edited_rows"].items():
+        row_id = int(df["id"].iat[i])
+        if row_id in pending["added"]:
+            pending["added"][row_id].update(delta)
+        else:
+            pending["edited"][row_id] = {**df.iloc[i].to_dict(), **delta, "id": row_id}
+
+    add_rows(pending, changes["added_rows"])
+
+    for i in changes["deleted_rows"]:
+        row_id = int(df["id"].iat[i])
+        if row_id in pending["added"]:
+            del pending["added"][row_id]
+        else:
+            pending["edited"].pop(row_id, None)
+            pending["deleted"][row_id] = int(df["version"].iat[i]) if "version" in df else None
+
+
+def apply_pending(df, pending, include_added=False):
+    """Returns `df` as it looks with the pending changes applied.
+
+    Meant for a page of rows: edited rows are rebuilt from their records.
+    Added rows are put on top if `include_added` is set.
+    """
+    records = [
+        pending["edited"].get(row_id, row)
+        for row_id, row in zip(df["id"].tolist(), df.to_dict("records"))
+        if row_id not in pending["deleted"]
+    ]
+    if include_added:
+        records = [*reversed(pending["added"].values()), *records]
+    return frame_like(records, df)
+
+
+def shown_pending(paging):
+    """Returns the changes to show on top of a page of `paging`.
+
+    Those are the pending changes and, under them, the changes of the commits
+    still being written, see `commit_pending`, so committed edits stay on the
+    page until it is read again with them. Rows being written show with the
+    version they will have once written, so editing them again does not
+    conflict with the commit. Added rows show once written, with the ids the
+    database gave them.
+    """
+    edited, deleted = {}, {}
+    for _, written in paging["writes"]:
+        for row_id, row in written["edited"].items():
+            edited[row_id] = _written_version(row)
+        for row_id in written["deleted"]:
+            edited.pop(row_id, None)
+            deleted[row_id] = None
+    pending = paging["pending"]
+    return {**pending, "edited": {**edited, **pending["edited"]}, "deleted": {**deleted, **pending["deleted"]}}
+
+
+def _written_version(row):
+    """Returns `row` with the version writing it gives it, if it has one."""
+    version = row.get("version")
+    if version is None or pd.isna(version):
+        return row
+    return {**row, "version": int(version) + 1}
+
+
+def _unwritten_versions(pending, written, row_ids):
+    """Gives back the version they were read at to the rows a commit did not write.
+
+    Edits made since the commit started from the version it would have given
+    them, see `shown_pending`.
+    """
+    for row_id in row_ids:
+        row = written["edited"].get(row_id)
+        if row is None or row.get("version") is None:
+            continue
+        expected = _written_version(row)["version"]
+        if row_id in pending["edited"] and pending["edited"][row_id].get("version") == expected:
+            pending["edited"][row_id] = {**pending["edited"][row_id], "version": row["version"]}
+        if pending["deleted"].get(row_id) == expected:
+            pending["deleted"][row_id] = row["version"]
+
+
+def pending_rows(pending):
+    """Returns the rows to upsert and the ids to delete to commit `pending`.
+
+    Added rows come without an id, so the database assigns one. The ids to
+    delete map to the version they were read at.
+    """
+    rows = [
+        *pending["edited"].values(),
+        *({**row, "id": None} for row in pending["added"].values()),
+    ]
+    return rows, dict(sorted(pending["deleted"].items()))
+
+
+def frame_like(records, df):
+    """Builds a frame from `records` with the columns and dtypes of `df`.
+
+    Categories are extended with any new values found in `records`.
+    """
+    new = pd.DataFrame.from_records(records, columns=df.columns)
+    for column in df.columns:
+        dtype = df[column].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            extra = pd.Index(new[column].dropna().unique()).difference(dtype.categories)
+            new[column] = pd.Categorical(new[column], categories=[*dtype.categories, *extra])
+        elif pd.api.types.is_integer_dtype(dtype) and new[column].isna().any():
+            # New rows may leave integer cells empty.
+            new[column] = new[column].astype("Int64")
+        else:
+            new[column] = new[column].astype(dtype)
+    return new
+
+
+# -----------------------------------------------------------------------------
+# Session state of a paginated `st.data_editor`.
+
+
+def init_paging(name):
+    """Returns the paging state of the editor called `name`, creating it if needed.
+
+    The state holds the pending changes, the cursors of the pages visited so
+    far and the page currently shown. A page is read once when it is entered
+    and then kept, because the editor's deltas refer to its row positions.
+    It also holds the commits being written, see `commit_pending`, and the
+    changes they could not write, see `resolve_conflicts`.
+    """
+    key = f"{name}_paging"
+    if key not in st.session_state:
+        st.session_state[key] = {
+            "pending": new_pending(),
+            "cursors": [None],
+            "next_cursor": None,
+            "visit": 0,
+            "page_df": None,
+            "writes": [],
+            "messages": [],
+            "conflicts": [],
+        }
+    return st.session_state[key]
+
+
+def editor_key(name):
+    """Returns the widget key of the editor for the page currently shown."""
+    return f"{name}_table_{st.session_state[f'{name}_paging']['visit']}"
+
+
+def editor_changes(name):
+    """Returns the deltas of the editor for the page currently shown."""
+    return st.session_state.get(
+        editor_key(name), {"edited_rows": {}, "added_rows": [], "deleted_rows": []}
+    )
+
+
+def leave_page(name):
+    """Keeps the edits made on the current page and drops the page.
+
+    The next run reads the page again and shows it in a fresh editor.
+    """
+    paging = st.session_state[f"{name}_paging"]
+    if paging["page_df"] is not None:
+        fold_editor_changes(paging["pending"], paging["page_df"], editor_changes(name))
+    paging["visit"] += 1
+    paging["page_df"] = None
+
+
+def turn_page(name, step):
+    """Callback of the previous/next page buttons."""
+    paging = st.session_state[f"{name}_paging"]
+    leave_page(name)
+    if step > 0:
+        paging["cursors"].append(paging["next_cursor"])
+    elif len(paging["cursors"]) > 1:
+        paging["cursors"].pop()
+
+
+def restart_paging(name):
+    """Callback of the sort, filter and page size widgets."""
+    leave_page(name)
+    st.session_state[f"{name}_paging"]["cursors"] = [None]
+
+
+def page_navigation(name):
+    """Shows the previous/next page buttons."""
+    paging = st.session_state[f"{name}_paging"]
+    previous_column, page_column, next_column = st.columns([1, 2, 1])
+    previous_column.button(
+        "Previous page",
+        key=f"{name}_previous_page",
+        disabled=len(paging["cursors"]) == 1,
+        on_click=turn_page,
+        args=(name, -1),
+    )
+    page_column.caption(f"Page {len(paging['cursors'])}")
+    next_column.button(
+        "Next page",
+        key=f"{name}_next_page",
+        disabled=paging["next_cursor"] is None,
+        on_click=turn_page,
+        args=(name, 1),
+    )
+
+
+# -----------------------------------------------------------------------------
+# Commits written in the background, see `utils.writer`.
+
+
+def commit_pending(name, db_filename, write):
+    """Callback of a commit button: queues the pending changes of editor `name`.
+
+    `write(conn, rows, deleted_ids)` applies them, see `pending_rows`. The
+    callback returns at once. The changes stop being pending straight away,
+    but stay shown on the page until they are written, see `shown_pending`,
+    and come back if the write fails, see `write_status`.
+    """
+    leave_page(name)
+    paging = st.session_state[f"{name}_paging"]
+    rows, deleted_ids = pending_rows(paging["pending"])
+    future = submit_write(db_filename, write, rows, deleted_ids)
+    paging["writes"].append((future, paging["pending"]))
+    # Provisional ids keep counting down, past those of the rows being written.
+    paging["pending"] = {**new_pending(), "next_id": paging["pending"]["next_id"]}
+
+
+def restore_pending(pending, failed):
+    """Puts the changes of a failed commit back into `pending`.
+
+    Edits made to the same rows since then win.
+    """
+    for row_id, row in failed["edited"].items():
+        pending["edited"].setdefault(row_id, row)
+    add_rows(pending, failed["added"].values())
+    for row_id, version in failed["deleted"].items():
+        pending["edited"].pop(row_id, None)
+        pending["deleted"][row_id] = version
+
+
+def write_status(name):
+    """Shows the outcome of the commits of editor `name`.
+
+    While commits are being written it checks on them every
+    `WRITE_POLL_INTERVAL` seconds, then reruns the app so the page is read
+    again with the new data.
+    """
+    paging = st.session_state[f"{name}_paging"]
+    run_every = WRITE_POLL_INTERVAL if paging["writes"] else None
+    st.fragment(_write_status, run_every=run_every)(name)
+
+
+def _write_status(name):
+    paging = st.session_state[f"{name}_paging"]
+    for message, icon in paging["messages"]:
+        st.toast(message, icon=icon)
+    paging["messages"] = []
+
+    done = [(future, pending) for future, pending in paging["writes"] if future.done()]
+    if not done:
+        if paging["writes"]:
+            st.caption("Saving changes...")
+        return
+
+    paging["writes"] = [(future, pending) for future, pending in paging["writes"] if not future.done()]
+    for future, pending in done:
+        error = future.exception()
+        conflicts = future.result() if error is None else None
+        if error is None:
+            _unwritten_versions(paging["pending"], pending, [c["id"] for c in conflicts or []])
+        else:
+            _unwritten_versions(paging["pending"], pending, [*pending["edited"], *pending["deleted"]])
+        if conflicts:
+            paging["conflicts"].extend(conflicts)
+            paging["messages"].append(
+                (f"{len(conflicts)} rows were changed by someone else first, see below.", ":material/warning:")
+            )
+        elif error is None:
+            paging["messages"].append(("Database updated!", ":material/check:"))
+        else:
+            restore_pending(paging["pending"], pending)
+            paging["messages"].append(
+                (f"Changes could not be saved and are pending again: {error}", ":material/error:")
+            )
+    leave_page(name)
+    st.rerun()
+
+
+# -----------------------------------------------------------------------------
+# Rows someone else changed first.
+
+
+def resolve_conflicts(name):
+    """Shows the changes of editor `name` that could not be written.
+
+    They were made to rows someone else changed or deleted after they were
+    read, see e.g. `utils.useful_functions.write_changes`. Each conflict shows
+    both versions of the row and lets the user keep either.
+    """
+    paging = st.session_state[f"{name}_paging"]
+    if not paging["conflicts"]:
+        return
+
+    st.warning(
+        "Some of your changes were not saved because someone else changed the same rows first. "
+        "Pick the version to keep for each of them."
+    )
+    for conflict in paging["conflicts"]:
+        with st.container(border=True):
+            versions = {"Yours": conflict["mine"], "Saved": conflict["theirs"]}
+            st.dataframe(
+                pd.DataFrame.from_records(
+                    [row for row in versions.values() if row is not None],
+                    index=[label for label, row in versions.items() if row is not None],
+                ),
+                use_container_width=True,
+            )
+            if conflict["mine"] is None:
+                st.caption("You deleted this row.")
+            if conflict["theirs"] is None:
+                st.caption("Someone else deleted this row.")
+
+            mine_column, theirs_column = st.columns(2)
+            mine_column.button(
+                "Keep yours",
+                key=f"{name}_keep_mine_{conflict['id']}",
+                on_click=_resolve_conflict,
+                args=(name, conflict["id"], True),
+            )
+            theirs_column.button(
+                "Keep saved",
+                key=f"{name}_keep_theirs_{conflict['id']}",
+                on_click=_resolve_conflict,
+                args=(name, conflict["id"], False),
+            )
+
+
+def _resolve_conflict(name, row_id, keep_mine):
+    paging = st.session_state[f"{name}_paging"]
+    conflict = next(c for c in paging["conflicts"] if c["id"] == row_id)
+    paging["conflicts"].remove(conflict)
+
+    # Keeping yours makes it a pending change again, based on the saved version.
+    mine, theirs = conflict["mine"], conflict["theirs"]
+    if keep_mine:
+        pending = paging["pending"]
+        if mine is None:
+            pending["edited"].pop(row_id, None)
+            pending["deleted"][row_id] = theirs.get("version")
+        elif theirs is None:
+            add_rows(pending, [mine])
+        else:
+            pending["edited"][row_id] = {**mine, "version": theirs.get("version")}
+    leave_page(name)
@@ -0,0 +1,388 @@
+from collections import defaultdict
+from pathlib import Path
+
+import pandas as pd
+
+from utils.bulk import export_bytes, export_chunks, import_chunks, read_frame
+from utils.cache import data_revision, get_revision_cache, track_changes, track_revisions
+from utils.connection import connect
+from utils.editing import keyset_page
+from utils.migrations import migrate
+
+DB_FILENAME = Path(__file__).parent.parent / "pages" / "inventory.db"
+
+# Items shown in each chart by default, the rest are summed into one bar.
+CHART_ROW_CAP = 25
+
+INVENTORY_COLUMNS = [
+    "id",
+    "item_name",
+    "price",
+    "units_sold",
+    "units_left",
+    "cost_price",
+    "reorder_point",
+    "description",
+]
+
+# Arrow types the columns are read into, see `utils.bulk.read_frame`.
+INVENTORY_TYPES = {
+    "id": "int64",
+    "item_name": "string",
+    "price": "double",
+    "units_sold": "int64",
+    "units_left": "int64",
+    "cost_price": "double",
+    "reorder_point": "int64",
+    "description": "string",
+}
+
+
+def connect_db():
+    """Connects to the sqlite database."""
+
+    return connect(DB_FILENAME)
+
+
+def prepare_database(conn):
+    """Migrates the inventory database to the latest schema version."""
+    migrate(conn, INVENTORY_MIGRATIONS)
+
+
+def initialize_data(conn):
+    """Fills the inventory table with some data."""
+    cursor = conn.cursor()
+
+    cursor.execute(
+        """
+        INSERT INTO inventory
+            (item_name, price, units_sold, units_left, cost_price, reorder_point, description)
+        VALUES
+            -- Beverages
+            ('Bottled Water (500ml)', 1.50, 115, 15, 0.80, 16, 'Hydrating bottled water'),
+            ('Soda (355ml)', 2.00, 93, 8, 1.20, 10, 'Carbonated soft drink'),
+            ('Energy Drink (250ml)', 2.50, 12, 18, 1.50, 8, 'High-caffeine energy drink'),
+            ('Coffee (hot, large)', 2.75, 11, 14, 1.80, 5, 'Freshly brewed hot coffee'),
+            ('Juice (200ml)', 2.25, 11, 9, 1.30, 5, 'Fruit juice blend'),
+
+            -- Snacks
+            ('Potato Chips (small)', 2.00, 34, 16, 1.00, 10, 'Salted and crispy potato chips'),
+            ('Candy Bar', 1.50, 6, 19, 0.80, 15, 'Chocolate and candy bar'),
+            ('Granola Bar', 2.25, 3, 12, 1.30, 8, 'Healthy and nutritious granola bar'),
+            ('Cookies (pack of 6)', 2.50, 8, 8, 1.50, 5, 'Soft and chewy cookies'),
+            ('Fruit Snack Pack', 1.75, 5, 10, 1.00, 8, 'Assortment of dried fruits and nuts'),
+
+            -- Personal Care
+            ('Toothpaste', 3.50, 1, 9, 2.00, 5, 'Minty toothpaste for oral hygiene'),
+            ('Hand Sanitizer (small)', 2.00, 2, 13, 1.20, 8, 'Small sanitizer bottle for on-the-go'),
+            ('Pain Relievers (pack)', 5.00, 1, 5, 3.00, 3, 'Over-the-counter pain relief medication'),
+            ('Bandages (box)', 3.00, 0, 10, 2.00, 5, 'Box of adhesive bandages for minor cuts'),
+            ('Sunscreen (small)', 5.50, 6, 5, 3.50, 3, 'Small bottle of sunscreen for sun protection'),
+
+            -- Household
+            ('Batteries (AA, pack of 4)', 4.00, 1, 5, 2.50, 3, 'Pack of 4 AA batteries'),
+            ('Light Bulbs (LED, 2-pack)', 6.00, 3, 3, 4.00, 2, 'Energy-efficient LED light bulbs'),
+            ('Trash Bags (small, 10-pack)', 3.00, 5, 10, 2.00, 5, 'Small trash bags for everyday use'),
+            ('Paper Towels (single roll)', 2.50, 3, 8, 1.50, 5, 'Single roll of paper towels'),
+            ('Multi-Surface Cleaner', 4.50, 2, 5, 3.00, 3, 'All-purpose cleaning spray'),
+
+            -- Others
+            ('Lottery Tickets', 2.00, 17, 20, 1.50, 10, 'Assorted lottery tickets'),
+            ('Newspaper', 1.50, 22, 20, 1.00, 5, 'Daily newspaper')
+        """
+    )
+    conn.commit()
+
+
+def load_data(conn):
+    """Loads the inventory data from the database."""
+    try:
+        df = read_frame(conn, f"SELECT {', '.join(INVENTORY_COLUMNS)} FROM inventory", types=INVENTORY_TYPES)
+    except:
+        return None
+
+    return df
+
+
+def load_page(conn, search, sort_column, ascending, after, page_size):
+    """Loads one page of the items whose name contains `search`."""
+    where, params = ("item_name LIKE ?", [f"%{search}%"]) if search else ("", [])
+    rows, next_cursor = keyset_page(
+        conn, "inventory", INVENTORY_COLUMNS, sort_column, ascending, after, page_size, where, params
+    )
+    return pd.DataFrame(rows, columns=INVENTORY_COLUMNS), next_cursor
+
+
+def load_low_stock(conn):
+    """Returns the names of the items with fewer units left than their reorder point.
+
+    Only reads the `inventory_low_stock` partial index, which holds just those
+    items, so the cost follows the number of items to reorder rather than the
+    size of the inventory.
+    """
+    return [
+        name
+        for name, in conn.execute(
+            "SELECT item_name FROM inventory WHERE units_left < reorder_point ORDER BY item_name"
+        )
+    ]
+
+
+def commit_changes(conn, rows, deleted_ids):
+    """Updates, inserts and deletes inventory items in one transaction, see `write_changes`."""
+    with conn:
+        write_changes(conn, rows, deleted_ids)
+
+
+def write_changes(conn, rows, deleted_ids):
+    """Updates, inserts and deletes inventory items, in the caller's transaction.
+
+    Rows with an id update that item, rows without one are inserted.
+    """
+    cursor = conn.cursor()
+
+    edited_rows = [row for row in rows if row["id"] is not None]
+    if edited_rows:
+        cursor.executemany(
+            """
+            UPDATE inventory
+            SET
+                item_name = :item_name,
+                price = :price,
+                units_sold = :units_sold,
+                units_left = :units_left,
+                cost_price = :cost_price,
+                reorder_point = :reorder_point,
+                description = :description
+            WHERE id = :id
+            """,
+            edited_rows,
+        )
+
+    added_rows = [row for row in rows if row["id"] is None]
+    if added_rows:
+        cursor.executemany(
+            """
+            INSERT INTO inventory
+                (id, item_name, price, units_sold, units_left, cost_price, reorder_point, description)
+            VALUES
+                (:id, :item_name, :price, :units_sold, :units_left, :cost_price, :reorder_point, :description)
+            """,
+            (defaultdict(lambda: None, row) for row in added_rows),
+        )
+
+    if deleted_ids:
+        cursor.executemany(
+            "DELETE FROM inventory WHERE id = :id",
+            ({"id": row_id} for row_id in deleted_ids),
+        )
+
+
+def import_items(conn, chunks, on_progress=None):
+    """Inserts items read with `read_chunks`, see `import_chunks`.
+
+    The ids of the file are ignored, the items get new ones.
+    """
+    return import_chunks(
+        conn, "inventory", INVENTORY_COLUMNS[1:], chunks, _to_item_row,
+        required=["item_name"], on_progress=on_progress,
+    )
+
+
+def export_items(conn, fmt):
+    """Returns all items as a CSV or Parquet file, in the format `import_items` reads."""
+    chunks = export_chunks(conn, "SELECT * FROM inventory ORDER BY id", INVENTORY_COLUMNS)
+    return export_bytes(chunks, fmt)
+
+
+def _to_item_row(row):
+    """Checks an imported item and converts it to the values stored in the database."""
+    if pd.isna(row.get("item_name")) or not str(row["item_name"]).strip():
+        raise ValueError("the item has no name")
+
+    item = {"item_name": str(row["item_name"]), "description": row.get("description")}
+    for column, kind in (
+        ("price", float),
+        ("cost_price", float),
+        ("units_sold", int),
+        ("units_left", int),
+        ("reorder_point", int),
+    ):
+        value = row.get(column)
+        if pd.isna(value):
+            item[column] = None
+        elif kind is int and float(value) % 1:
+            raise ValueError(f"{column} {value!r} is not a whole number")
+        else:
+            item[column] = kind(float(value))
+    if pd.isna(item["description"]):
+        item["description"] = None
+    return item
+
+
+# -----------------------------------------------------------------------------
+# Migrations.
+
+
+def _create_inventory_table(conn):
+    """Migration 1: creates the inventory table, which older databases have."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS inventory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_name TEXT,
+            price REAL,
+            units_sold INTEGER,
+            units_left INTEGER,
+            cost_price REAL,
+            reorder_point INTEGER,
+            description TEXT
+        )
+        """
+    )
+
+
+def _index_low_stock(conn):
+    """Migration 2: indexes the items that need to be reordered.
+
+    SQLite keeps a partial index up to date on every insert, update and
+    delete, like a trigger-maintained table would be, but with no extra code.
+    A query uses it when its WHERE clause repeats the index condition. The
+    compared columns are in the index too, so the table is never read.
+    """
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS inventory_low_stock
+        ON inventory (item_name, units_left, reorder_point)
+        WHERE units_left < reorder_point
+        """
+    )
+
+
+def _track_inventory_revisions(conn):
+    """Migration 3: keeps a revision counter of the inventory table for the caches."""
+    track_revisions(conn, "inventory")
+
+
+def _log_inventory_changes(conn):
+    """Migration 4: logs which items each write touched, see `utils.cache.track_changes`."""
+    track_changes(conn, "inventory")
+
+
+# Never edit or reorder these, only append: a database's `user_version` is
+# the number of them it has already gone through.
+INVENTORY_MIGRATIONS = [
+    _create_inventory_table,
+    _index_low_stock,
+    _track_inventory_revisions,
+    _log_inventory_changes,
+]
+
+
+# -----------------------------------------------------------------------------
+# Charts.
+
+
+def units_left_data(conn, limit=CHART_ROW_CAP):
+    """Returns the `limit` items closest to, or furthest below, their reorder point.
+
+    The other items are summed into a last "Others" row.
+    """
+    return _top_items(conn, ["units_left", "reorder_point"], "units_left - reorder_point", limit)
+
+
+def best_sellers_data(conn, limit=CHART_ROW_CAP):
+    """Returns the `limit` best selling items and an "Others" row for the rest."""
+    return _top_items(conn, ["units_sold"], "units_sold DESC", limit)
+
+
+def _top_items(conn, columns, order, limit):
+    """Returns the first `limit` items in `order`, then the sums of the rest.
+
+    `rank` gives the order to draw the rows in.
+    """
+    rows = conn.execute(
+        f"SELECT item_name, {', '.join(columns)} FROM inventory ORDER BY {order}, id LIMIT ?",
+        (limit,),
+    ).fetchall()
+    df = pd.DataFrame(rows, columns=["item_name", *columns])
+
+    count, *totals = conn.execute(
+        f"SELECT COUNT(*), {', '.join(f'IFNULL(SUM({c}), 0)' for c in columns)} FROM inventory"
+    ).fetchone()
+    if count > len(df):
+        others = {
+            "item_name": f"Others ({count - len(df)} items)",
+            **{c: total - df[c].sum() for c, total in zip(columns, totals)},
+        }
+        df = pd.concat([df, pd.DataFrame([others])], ignore_index=True)
+
+    df["rank"] = range(len(df))
+    return df
+
+
+def chart_spec(conn, chart, limit=CHART_ROW_CAP):
+    """Returns the Vega-Lite spec of a chart, see `CHARTS`.
+
+    Specs are cached until the inventory changes.
+    """
+    key = (getattr(conn, "db_filename", None), "chart", chart, limit)
+    revision = data_revision(conn, "inventory")
+
+    cache = get_revision_cache()
+    spec = cache.get(key, revision)
+    if spec is None:
+        load, draw = CHARTS[chart]
+        spec = draw(load(conn, limit)).to_dict()
+        cache.put(key, revision, spec)
+
+    return spec
+
+
+def units_left_chart(df):
+    """Charts the units left of each item against its reorder point."""
+    import altair as alt  # Slow to import, and only needed when a spec is not cached.
+
+    # Both layers share the data, so it is embedded in the spec only once.
+    base = alt.Chart(df).encode(
+        y=alt.Y("item_name", sort=alt.EncodingSortField("rank")),
+    )
+    return alt.layer(
+        # Layer 1: Bar chart.
+        base.mark_bar(
+            orient="horizontal",
+        ).encode(
+            x="units_left",
+        ),
+        # Layer 2: Chart showing the reorder point.
+        base.mark_point(
+            shape="diamond",
+            filled=True,
+            size=50,
+            color="salmon",
+            opacity=1,
+        ).encode(
+            x="reorder_point",
+        ),
+    )
+
+
+def best_sellers_chart(df):
+    """Charts the units sold of each item, best sellers first."""
+    import altair as alt  # See `units_left_chart`.
+
+    return (
+        alt.Chart(df)
+        .mark_bar(orient="horizontal")
+        .encode(
+            x="units_sold",
+            y=alt.Y("item_name", sort=alt.EncodingSortField("rank")),
+        )
+    )
+
+
+# name -> (function loading the chart data, function drawing it)
+CHARTS = {
+    "units_left": (units_left_data, units_left_chart),
+    "best_sellers": (best_sellers_data, best_sellers_chart),
+}
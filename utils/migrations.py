@@ -0,0 +1,33 @@
+def schema_version(conn):
+    """Returns the schema version recorded in the database file."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, migrations):
+    """Applies the migrations a database has not seen yet, in order.
+
+    `migrations` is the full list of migration functions of a database. Each
+    takes a connection and runs in its own transaction, after which the
+    database's `user_version` is set to the number of migrations applied.
+    Returns True if any migration ran.
+    """
+    if schema_version(conn) >= len(migrations):
+        return False
+
+    applied = False
+    while True:
+        # IMMEDIATE takes the write lock up front, so two sessions starting
+        # at the same time cannot both run the same migration.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(conn)
+            if version >= len(migrations):
+                conn.rollback()
+                return applied
+            migrations[version](conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        applied = True
@@ -0,0 +1,276 @@
+import functools
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+
+# Profiles are appended here when logging is switched on in the debug panel.
+LOG_FILENAME = Path(__file__).parent.parent / "profiling.jsonl"
+
+# Queries kept per rerun, so a runaway loop cannot eat the memory.
+MAX_QUERIES = 1000
+
+# Fragment reruns kept until the next full rerun shows them, see `profiled`.
+MAX_FRAGMENT_PROFILES = 50
+
+# The profiler of the rerun running on each thread. Streamlit runs a session's
+# script on its own thread, so queries and stages land in the right profile.
+_local = threading.local()
+
+
+class Profiler:
+    """Collects the timed stages and SQL queries of one rerun."""
+
+    def __init__(self, page, fragment=None):
+        self.page = page
+        self.fragment = fragment
+        self.started = time.perf_counter()
+        self.stages = []
+        self.queries = []
+        self._open_stages = []
+
+    @contextmanager
+    def stage(self, name):
+        parent = self._open_stages[-1] if self._open_stages else None
+        record = {"stage": name, "parent": parent, "seconds": 0.0}
+        self.stages.append(record)
+        self._open_stages.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            self._open_stages.pop()
+
+    def query(self, sql):
+        """Returns a new record for `sql`, which the cursor fills in."""
+        record = {
+            "stage": self._open_stages[-1] if self._open_stages else None,
+            "sql": " ".join(sql.split()),
+            "seconds": 0.0,
+            "rows": 0,
+        }
+        if len(self.queries) < MAX_QUERIES:
+            self.queries.append(record)
+        return record
+
+    def summary(self):
+        return {
+            "time": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "page": self.page,
+            "fragment": self.fragment,
+            "total_seconds": time.perf_counter() - self.started,
+            "sql_seconds": sum(q["seconds"] for q in self.queries),
+            "stages": self.stages,
+            "queries": self.queries,
+        }
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    """A cursor timing its queries and counting the rows they return.
+
+    Connections hand these out instead of plain cursors while a rerun is
+    profiled, see `utils.connection.Connection.cursor`.
+    """
+
+    def __init__(self, connection, profiler):
+        super().__init__(connection)
+        self._profiler = profiler
+        self._record = None
+
+    def execute(self, sql, parameters=()):
+        self._record = self._profiler.query(sql)
+        with self._timed():
+            super().execute(sql, parameters)
+        self._count_changes()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._record = self._profiler.query(sql)
+        with self._timed():
+            super().executemany(sql, seq_of_parameters)
+        self._count_changes()
+        return self
+
+    def executescript(self, sql_script):
+        self._record = self._profiler.query(sql_script)
+        with self._timed():
+            super().executescript(sql_script)
+        return self
+
+    def fetchone(self):
+        with self._timed():
+            row = super().fetchone()
+        self._count_rows(0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        with self._timed():
+            rows = super().fetchmany(self.arraysize if size is None else size)
+        self._count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        with self._timed():
+            rows = super().fetchall()
+        self._count_rows(len(rows))
+        return rows
+
+    def __next__(self):
+        with self._timed():
+            row = super().__next__()
+        self._count_rows(1)
+        return row
+
+    @contextmanager
+    def _timed(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self._record is not None:
+                self._record["seconds"] += time.perf_counter() - start
+
+    def _count_rows(self, n):
+        if self._record is not None:
+            self._record["rows"] += n
+
+    def _count_changes(self):
+        # Writes report the rows they changed, reads count rows as fetched.
+        if self.rowcount > 0:
+            self._record["rows"] = self.rowcount
+
+
+def current_profiler():
+    """Returns the profiler of the rerun on this thread, None if not profiled."""
+    return getattr(_local, "profiler", None)
+
+
+def start_profiling(page):
+    """Shows the profiling switch and starts profiling the rerun if it is on.
+
+    Call it at the top of a page and `show_profile` at the bottom.
+    """
+    enabled = st.sidebar.toggle(
+        "Profile reruns",
+        value=st.session_state.get("profile_reruns", False),
+        help="Time each stage of the page and every SQL query.",
+    )
+    # Not widget keys: widget state is dropped when switching pages.
+    st.session_state.profile_reruns = enabled
+    st.session_state.profile_page = page
+    _local.profiler = Profiler(page) if enabled else None
+
+
+def profiled(name):
+    """Profiles the reruns of a fragment on their own.
+
+    Put it under `st.fragment`. A fragment rerun runs on a thread of its own
+    and never reaches `show_profile`, so its profile is logged straight away
+    and shown in the sidebar on the next full rerun. In a full rerun the
+    fragment is part of the page's profile.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if current_profiler() is not None or not st.session_state.get("profile_reruns", False):
+                return func(*args, **kwargs)
+
+            _local.profiler = Profiler(st.session_state.get("profile_page"), name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                summary = _local.profiler.summary()
+                _local.profiler = None
+                profiles = st.session_state.setdefault("fragment_profiles", [])
+                profiles.append(summary)
+                del profiles[:-MAX_FRAGMENT_PROFILES]
+                if st.session_state.get("profile_log", False):
+                    _log(summary)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def stage(name):
+    """Times a named stage of the rerun. Does nothing when not profiling."""
+    profiler = current_profiler()
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
+
+
+def show_profile():
+    """Stops profiling and shows the profile of the rerun in the sidebar.
+
+    The fragment reruns since the previous full rerun are shown too, see
+    `profiled`.
+    """
+    profiler = current_profiler()
+    _local.profiler = None
+    fragment_profiles = st.session_state.pop("fragment_profiles", [])
+    if profiler is None:
+        return
+
+    if fragment_profiles:
+        with st.sidebar.expander(f"Fragment reruns: {len(fragment_profiles)}"):
+            reruns = pd.DataFrame(
+                {
+                    "fragment": [p["fragment"] for p in fragment_profiles],
+                    "ms": [p["total_seconds"] * 1000 for p in fragment_profiles],
+                    "sql ms": [p["sql_seconds"] * 1000 for p in fragment_profiles],
+                    "queries": [len(p["queries"]) for p in fragment_profiles],
+                }
+            )
+            st.dataframe(reruns, hide_index=True, use_container_width=True)
+            slowest = max(fragment_profiles, key=lambda p: p["total_seconds"])
+            st.caption(f"Slowest, {slowest['fragment']}:")
+            _show_tables(slowest)
+
+    summary = profiler.summary()
+    with st.sidebar.expander(
+        f"Profile: {summary['total_seconds'] * 1000:.0f} ms, "
+        f"{len(summary['queries'])} queries",
+        expanded=True,
+    ):
+        st.caption(f"SQL: {summary['sql_seconds'] * 1000:.1f} ms")
+        _show_tables(summary)
+
+        log = st.checkbox(
+            f"Append to {LOG_FILENAME.name}",
+            value=st.session_state.get("profile_log", False),
+        )
+        st.session_state.profile_log = log
+
+    if log:
+        _log(summary)
+
+
+def _show_tables(summary):
+    if summary["stages"]:
+        stages = pd.DataFrame(summary["stages"])
+        stages["ms"] = stages.pop("seconds") * 1000
+        st.dataframe(stages, hide_index=True, use_container_width=True)
+    if summary["queries"]:
+        queries = pd.DataFrame(summary["queries"])
+        queries["ms"] = queries.pop("seconds") * 1000
+        st.dataframe(
+            queries.sort_values("ms", ascending=False),
+            hide_index=True,
+            use_container_width=True,
+        )
+
+
+def _log(summary):
+    with open(LOG_FILENAME, "a") as f:
+        f.write(json.dumps(summary) + "\n")
@@ -0,0 +1,348 @@
+"""Critical path scheduling of the tasks, from their durations and dependencies.
+
+A task can start once every task it depends on is finished. Tasks that are
+done take no more time, the others their full `duration` in days, counted
+from today. Weekends and holidays are not taken into account.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.cache import changed_since, data_revision, get_revision_cache
+from utils.useful_functions import STATUSES
+
+# Tasks shown in the timeline, those with the least slack first.
+TIMELINE_ROW_CAP = 25
+
+
+class Schedule:
+    """Earliest and latest start of each task, and the critical path.
+
+    The tasks are put in topological order once, in levels: a task's level is
+    one more than the highest level of the tasks it depends on. Each pass then
+    handles a whole level at a time with NumPy, so a schedule of thousands of
+    tasks costs as many Python steps as the longest chain of dependencies.
+    Schedules are shared by every session, so they are never modified:
+    `with_durations` makes a new one.
+    """
+
+    def __init__(self, ids, durations, depends_on, task_ids):
+        """`depends_on[i]` must be finished before `task_ids[i]` starts."""
+        self.ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(self.ids)
+        self.ids = self.ids[order]
+        self.durations = np.asarray(durations, dtype=np.int64)[order]
+        self.src = np.searchsorted(self.ids, np.asarray(depends_on, dtype=np.int64))
+        self.dst = np.searchsorted(self.ids, np.asarray(task_ids, dtype=np.int64))
+
+        n = len(self.ids)
+        self.levels = topological_levels(n, self.src, self.dst)
+        depth = int(self.levels.max()) + 1 if n else 0
+        self._nodes, self._node_bounds = _group_by(self.levels, depth)
+        # Incoming edges by the level of their task, outgoing ones by the level
+        # of the task they leave from.
+        self._incoming, self._incoming_bounds = _group_by(self.levels[self.dst], depth)
+        self._outgoing, self._outgoing_bounds = _group_by(self.levels[self.src], depth)
+
+        self.earliest_start = np.zeros(n, dtype=np.int64)
+        self.earliest_finish = np.zeros(n, dtype=np.int64)
+        self.latest_start = np.zeros(n, dtype=np.int64)
+        self.latest_finish = np.zeros(n, dtype=np.int64)
+        self._forward(0)
+        self._backward(depth - 1)
+
+    def with_durations(self, ids, durations):
+        """Returns the schedule with new durations for some tasks.
+
+        Only the levels the changes can reach are computed again: earliest
+        times from the first changed level on, and latest times up to the
+        last one, unless the end of the project moves.
+        """
+        positions = np.searchsorted(self.ids, np.asarray(ids, dtype=np.int64))
+        schedule = object.__new__(Schedule)
+        schedule.__dict__.update(self.__dict__)
+        for name in ("durations", "earliest_start", "earliest_finish", "latest_start", "latest_finish"):
+            setattr(schedule, name, getattr(self, name).copy())
+        schedule.durations[positions] = durations
+
+        if len(positions):
+            levels = self.levels[positions]
+            schedule._forward(int(levels.min()))
+            if schedule.end == self.end:
+                schedule._backward(int(levels.max()))
+            else:
+                schedule._backward(len(self._node_bounds) - 2)
+        return schedule
+
+    @property
+    def end(self):
+        """Days from today until every task is done."""
+        return int(self.earliest_finish.max()) if len(self.ids) else 0
+
+    @property
+    def slack(self):
+        """Days each task can be late without delaying the end."""
+        return self.latest_start - self.earliest_start
+
+    def frame(self):
+        """Returns the schedule of each task, in days from today."""
+        return pd.DataFrame(
+            {
+                "id": self.ids,
+                "earliest_start": self.earliest_start,
+                "earliest_finish": self.earliest_finish,
+                "latest_start": self.latest_start,
+                "latest_finish": self.latest_finish,
+                "slack": self.slack,
+                "critical": self.slack == 0,
+            }
+        )
+
+    def critical_path(self):
+        """Returns the ids of the tasks that take time and have no slack, in order."""
+        on_path = np.flatnonzero((self.slack == 0) & (self.durations > 0))
+        return self.ids[on_path[np.argsort(self.earliest_start[on_path], kind="stable")]]
+
+    def _forward(self, first_level):
+        es, ef = self.earliest_start, self.earliest_finish
+        for level in range(first_level, len(self._node_bounds) - 1):
+            nodes = _level(self._nodes, self._node_bounds, level)
+            edges = _level(self._incoming, self._incoming_bounds, level)
+            es[nodes] = 0
+            np.maximum.at(es, self.dst[edges], ef[self.src[edges]])
+            ef[nodes] = es[nodes] + self.durations[nodes]
+
+    def _backward(self, last_level):
+        ls, lf = self.latest_start, self.latest_finish
+        end = self.end
+        for level in range(last_level, -1, -1):
+            nodes = _level(self._nodes, self._node_bounds, level)
+            edges = _level(self._outgoing, self._outgoing_bounds, level)
+            lf[nodes] = end
+            np.minimum.at(lf, self.src[edges], ls[self.dst[edges]])
+            ls[nodes] = lf[nodes] - self.durations[nodes]
+
+
+def topological_levels(n, src, dst):
+    """Returns the level of each of `n` nodes given edges from `src` to `dst`.
+
+    Kahn's algorithm, taking every node left without incoming edges at once.
+    Raises ValueError if the edges make a cycle.
+    """
+    indegree = np.bincount(dst, minlength=n)
+    # Outgoing edges of each node, as slices of `dst[order]`.
+    order = np.argsort(src, kind="stable")
+    starts = np.searchsorted(src[order], np.arange(n + 1))
+
+    levels = np.full(n, -1, dtype=np.int64)
+    frontier = np.flatnonzero(indegree == 0)
+    level = 0
+    while frontier.size:
+        levels[frontier] = level
+        counts = starts[frontier + 1] - starts[frontier]
+        offsets = np.repeat(starts[frontier] - (np.cumsum(counts) - counts), counts)
+        targets = dst[order[offsets + np.arange(counts.sum())]]
+        indegree -= np.bincount(targets, minlength=n)
+        targets = np.unique(targets)
+        frontier = targets[indegree[targets] == 0]
+        level += 1
+
+    if (levels < 0).any():
+        raise ValueError(f"Dependencies make a cycle through {int((levels < 0).sum())} tasks")
+    return levels
+
+
+def _group_by(keys, count):
+    """Returns the positions sorted by key, and where each key starts in them."""
+    order = np.argsort(keys, kind="stable")
+    return order, np.searchsorted(keys[order], np.arange(count + 1))
+
+
+def _level(items, bounds, level):
+    return items[bounds[level]:bounds[level + 1]]
+
+
+# -----------------------------------------------------------------------------
+# Dependencies in the database.
+
+
+def load_dependencies(conn):
+    """Returns the `(task_id, depends_on)` pairs as two arrays."""
+    rows = conn.execute("SELECT task_id, depends_on FROM task_dependencies").fetchall()
+    pairs = np.array(rows, dtype=np.int64).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+def dependencies_of(conn, task_id):
+    """Returns the ids of the tasks `task_id` depends on."""
+    return [
+        row_id for row_id, in conn.execute(
+            "SELECT depends_on FROM task_dependencies WHERE task_id = ? ORDER BY depends_on", (task_id,)
+        )
+    ]
+
+
+def set_dependencies(conn, task_id, depends_on):
+    """Makes `task_id` depend on exactly the tasks `depends_on`.
+
+    Raises ValueError, and changes nothing, if a task does not exist or the
+    dependencies would make a cycle.
+    """
+    depends_on = sorted(set(depends_on))
+    with conn:
+        known = {
+            row_id for row_id, in conn.execute(
+                "SELECT id FROM tasks WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps([task_id, *depends_on]),),
+            )
+        }
+        missing = [i for i in [task_id, *depends_on] if i not in known]
+        if missing:
+            raise ValueError(f"No task with id {', '.join(map(str, missing))}")
+        if task_id in depends_on:
+            raise ValueError(f"Task {task_id} cannot depend on itself")
+
+        conn.execute("DELETE FROM task_dependencies WHERE task_id = ?", (task_id,))
+        conn.executemany(
+            "INSERT INTO task_dependencies (task_id, depends_on) VALUES (?, ?)",
+            [(task_id, other) for other in depends_on],
+        )
+
+        task_ids, others = load_dependencies(conn)
+        ids, edges = np.unique(np.concatenate([others, task_ids]), return_inverse=True)
+        topological_levels(len(ids), edges[:len(others)], edges[len(others):])
+
+
+def load_schedule(conn):
+    """Returns the schedule of the tasks, see `Schedule`.
+
+    Schedules are cached until the tasks or their dependencies change. When
+    only durations or statuses changed since, the cached schedule is updated
+    instead of computed again.
+    """
+    key = (getattr(conn, "db_filename", None), "schedule")
+    revision = (data_revision(conn, "tasks"), data_revision(conn, "task_dependencies"))
+
+    cache = get_revision_cache()
+    schedule = cache.get(key, revision)
+    if schedule is None:
+        latest = cache.latest(key)
+        if latest is not None and None not in revision and latest[0][1] == revision[1]:
+            schedule = _update_schedule(conn, latest[0][0], latest[1])
+            if schedule is not None:
+                cache.count_update()
+        if schedule is None:
+            schedule = _read_schedule(conn)
+        cache.put(key, revision, schedule)
+
+    return schedule
+
+
+def _read_schedule(conn):
+    df = pd.DataFrame(
+        conn.execute("SELECT id, duration, status FROM tasks").fetchall(),
+        columns=["id", "duration", "status"],
+    )
+    task_ids, depends_on = load_dependencies(conn)
+    return Schedule(df["id"], _remaining_days(df), depends_on, task_ids)
+
+
+def _update_schedule(conn, revision, schedule):
+    """Returns `schedule` with the tasks changed since `revision`, or None.
+
+    None means tasks were added or deleted, so the schedule must be computed
+    again.
+    """
+    changed = changed_since(conn, "tasks", revision)
+    if len(changed) > len(schedule.ids) // 2:
+        return None
+
+    df = pd.DataFrame(
+        conn.execute(
+            "SELECT id, duration, status FROM tasks WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(changed),),
+        ).fetchall(),
+        columns=["id", "duration", "status"],
+    )
+    positions = np.searchsorted(schedule.ids, df["id"].to_numpy(dtype=np.int64))
+    positions = np.minimum(positions, len(schedule.ids) - 1)
+    if len(df) != len(changed) or not (schedule.ids[positions] == df["id"].to_numpy()).all():
+        return None
+    return schedule.with_durations(df["id"], _remaining_days(df))
+
+
+def _remaining_days(df):
+    """Days left for each stored task: none once it is done, else its duration."""
+    days = df["duration"].fillna(0).to_numpy(dtype=np.int64)
+    return np.where(df["status"].to_numpy() == STATUSES.index("Done"), 0, days)
+
+
+# -----------------------------------------------------------------------------
+# Timeline and dependency editing.
+
+
+def timeline_data(conn, schedule, limit=TIMELINE_ROW_CAP):
+    """Returns the dates of the `limit` tasks with the least slack.
+
+    Done tasks and tasks without a duration are left out.
+    """
+    df = schedule.frame()[schedule.durations > 0]
+    df = df.nsmallest(limit, ["slack", "earliest_start", "id"])
+    descriptions = dict(
+        conn.execute(
+            "SELECT id, description FROM tasks WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps(df["id"].tolist()),),
+        ).fetchall()
+    )
+    today = pd.Timestamp.now().normalize()
+    return pd.DataFrame(
+        {
+            "task": [f"{i}: {descriptions.get(i) or ''}"[:60] for i in df["id"]],
+            "start": today + pd.to_timedelta(df["earliest_start"], unit="D"),
+            "finish": today + pd.to_timedelta(df["earliest_finish"], unit="D"),
+            "latest_finish": today + pd.to_timedelta(df["latest_finish"], unit="D"),
+            "slack": df["slack"],
+            "critical": df["critical"],
+        }
+    )
+
+
+def timeline_chart(df):
+    """Charts when each task can start and finish at the earliest."""
+    import altair as alt  # Slow to import, see `utils.inventory.units_left_chart`.
+
+    return (
+        alt.Chart(df)
+        .mark_bar()
+        .encode(
+            x=alt.X("start", title=None),
+            x2="finish",
+            y=alt.Y("task", sort=alt.EncodingSortField("start"), title=None),
+            color=alt.Color("critical", title="Critical", scale=alt.Scale(domain=[True, False], range=["salmon", "steelblue"])),
+            tooltip=["task", "start", "finish", "latest_finish", "slack"],
+        )
+    )
+
+
+def dependencies_panel(conn):
+    """Shows the tasks a task depends on, and lets them be changed."""
+    task_id = int(st.number_input("Task ID", min_value=1, step=1, key="dependencies_task"))
+    text = st.text_input(
+        "Depends on tasks",
+        value=", ".join(map(str, dependencies_of(conn, task_id))),
+        help="IDs of the tasks that must be done before this one starts, separated by commas.",
+        key=f"dependencies_{task_id}",
+    )
+    if st.button("Save dependencies", key="dependencies_save"):
+        words = text.replace(",", " ").split()
+        try:
+            invalid = [word for word in words if not word.isdigit()]
+            if invalid:
+                raise ValueError(f"Not task IDs: {', '.join(invalid)}")
+            set_dependencies(conn, task_id, map(int, words))
+        except ValueError as error:
+            st.error(f"Dependencies not saved. {error}")
+        else:
+            st.toast(f"Dependencies of task {task_id} saved!")
@@ -1,81 +1,779 @@
-import sqlite3
-import altair as alt
+import json
+import time
 import numpy as np
 import pandas as pd
-import streamlit as st
-from collections import defaultdict
-import glob 
 from pathlib import Path
-import os
+
+from utils.bulk import export_bytes, export_chunks, import_chunks, read_frame
+from utils.cache import (
+    changed_since,
+    data_revision,
+    get_revision_cache,
+    shared_view,
+    track_changes,
+    track_revisions,
+)
+from utils.connection import connect
+from utils.editing import keyset_page
+from utils.migrations import migrate
+from utils.profiling import stage
+
+DB_FILENAME = Path(__file__).parent.parent / "tasks_demo.db"
 
 PRIORITIES = ['Low', 'Medium', 'High']
 STATUSES = ['Not Started', 'In Progress', 'Done']
+SUBSYSTEMS = ["HV", "LV", "DAQ/monitoring", "Time reference", "MCP", "Electronics", "Cooling", "Trigger", "Beamline", "Mechanics/Prototype", "Planning"]
 
-def connect_db():
-    """Connects to the sqlite database."""
+TASK_COLUMNS = [
+    "id",
+    "description",
+    "sub_system",
+    "status",
+    "priority",
+    "submission_date",
+    "duration",
+    "contact_person",
+]
+
+# Kept for each task to detect edits made by someone else, see `write_changes`.
+VERSION_COLUMNS = ["version", "updated_at"]
+STORED_TASK_COLUMNS = TASK_COLUMNS + VERSION_COLUMNS
+
+# Arrow types the stored columns are read into, see `utils.bulk.read_frame`.
+STORED_TASK_TYPES = {
+    "id": "int64",
+    "description": "string",
+    "sub_system": "string",
+    "status": "int8",
+    "priority": "int8",
+    "submission_date": "int64",
+    "duration": "int64",
+    "contact_person": "string",
+    "version": "int64",
+    "updated_at": "int64",
+}
+
+# Columns the home page filters on, each backed by an index.
+INDEXED_COLUMNS = ["contact_person", "priority", "sub_system", "duration", "submission_date"]
+
+# Columns whose distinct values and their counts are kept in `task_facets`.
+FACET_COLUMNS = ["contact_person", "sub_system", "status", "priority"]
+
+# Schema of the tasks table before migration 2 made it typed, see `_create_tasks_table`.
+TASKS_TABLE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        description TEXT,
+        sub_system TEXT,
+        status TEXT,
+        priority TEXT,
+        submission_date DATETIME,
+        duration INTEGER,
+        contact_person TEXT
+    )
+"""
 
-    DB_FILENAME = Path(__file__).parent.parent / "tasks_demo.db"
-    db_already_exists = DB_FILENAME.exists()
+# A task waits for the tasks it depends on to be done, see `utils.scheduling`.
+DEPENDENCIES_TABLE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS task_dependencies (
+        task_id INTEGER NOT NULL REFERENCES tasks (id) ON DELETE CASCADE,
+        depends_on INTEGER NOT NULL REFERENCES tasks (id) ON DELETE CASCADE,
+        PRIMARY KEY (task_id, depends_on)
+    ) WITHOUT ROWID
+"""
 
-    conn = sqlite3.connect(DB_FILENAME)
-    db_was_just_created = not db_already_exists
+def connect_db():
+    """Connects to the sqlite database."""
 
-    return conn, db_was_just_created
+    return connect(DB_FILENAME)
 
 def initialize_data(conn):
     """Initializes the task database."""
-    cursor = conn.cursor()
+    seed_rows = [
+        ('This is a test task.', 'HV', 'Not Started', 'Low', '2025-02-27', 10, 'Marion'),
+        ('This is an important test task.', 'HV', 'Not Started', 'High', '2025-02-27', 20, 'Marion'),
+        ('This is a another test task.', 'LV', 'Not Started', 'Medium', '2025-02-27', 10, 'Michal'),
+        ('Have organisation meeting', 'Planning', 'In Progress', 'Low', '2025-02-28', 2, 'Marion'),
+    ]
+    rows = [
+        dict(zip(TASK_COLUMNS[1:], row), submission_date=pd.Timestamp(row[4]))
+        for row in seed_rows
+    ]
+    commit_changes(conn, rows, [])
+
+def load_data(conn):
+    """Loads the tasks data, reusing the frame cached for the current revision.
+
+    A frame cached at an older revision is brought up to date by reading only
+    the tasks written since, see `update_tasks`. The cache is shared by all
+    sessions, so callers get a view of the cached snapshot they are free to
+    modify, see `shared_view`.
+    """
+    key = (getattr(conn, "db_filename", None), "tasks")
+    revision = data_revision(conn, "tasks")
+
+    cache = get_revision_cache()
+    df = cache.get(key, revision)
+    if df is None:
+        latest = cache.latest(key)
+        if latest is not None and revision is not None:
+            df = update_tasks(conn, *latest)
+            if df is not None:
+                cache.count_update()
+        if df is None:
+            df = read_tasks(conn)
+        if df is not None:
+            cache.put(key, revision, df)
+
+    return None if df is None else shared_view(df)
+
+def read_tasks(conn, arrow=True):
+    """Reads the whole tasks table from the database, see `read_frame`."""
+    try:
+        df = read_frame(
+            conn, f"SELECT {', '.join(STORED_TASK_COLUMNS)} FROM tasks ORDER BY id", types=STORED_TASK_TYPES,
+            arrow=arrow,
+        )
+    except:
+        return None
+
+    with stage("decode tasks"):
+        df = _decode_tasks(df)
+
+    return df
+
+def update_tasks(conn, revision, df):
+    """Returns `df`, read at `revision`, with the tasks written since then.
+
+    Returns None when so many tasks changed that reading them all is cheaper.
+    The revision must be read before calling this: a task written in between
+    is then read again next time, but never missed.
+    """
+    changed = changed_since(conn, "tasks", revision)
+    if len(changed) > len(df) // 2:
+        return None
+
+    rows = conn.execute(
+        f"SELECT {', '.join(STORED_TASK_COLUMNS)} FROM tasks "
+        "WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(changed),),
+    ).fetchall()
+    new = _decode_tasks(pd.DataFrame(rows, columns=STORED_TASK_COLUMNS))
+
+    # Deleted tasks are simply not read again.
+    kept = df[~df["id"].isin(changed)].copy()
+    # Both parts need the same categories to stay categorical once together.
+    for column in ("sub_system", "contact_person"):
+        categories = kept[column].cat.categories.union(new[column].cat.categories)
+        kept[column] = kept[column].cat.set_categories(categories)
+        new[column] = new[column].cat.set_categories(categories)
+    df = pd.concat([kept, new], ignore_index=True).sort_values("id", ignore_index=True)
+
+    # Then they get the categories a full read would give them, without the
+    # values no task has any more.
+    df["sub_system"] = _recategorize(df["sub_system"], SUBSYSTEMS)
+    df["contact_person"] = _recategorize(df["contact_person"])
+    return df
+
+def _decode_tasks(df):
+    """Turns stored rows into a compact frame.
+
+    Repeated strings become categoricals (status and priority straight from
+    their stored codes), `duration` a nullable integer and `submission_date`
+    and `updated_at` datetime64 converted from epoch seconds.
+    """
+    df["sub_system"] = _to_categorical(df["sub_system"], SUBSYSTEMS)
+    df["status"] = pd.Categorical.from_codes(_to_codes(df["status"]), categories=STATUSES)
+    df["priority"] = pd.Categorical.from_codes(_to_codes(df["priority"]), categories=PRIORITIES)
+    df["submission_date"] = pd.to_datetime(df["submission_date"], unit="s")
+    df["duration"] = df["duration"].astype("Int64")
+    df["contact_person"] = _to_categorical(df["contact_person"])
+    if "updated_at" in df:
+        df["updated_at"] = pd.to_datetime(df["updated_at"], unit="s")
+    return df
+
+def _to_codes(series):
+    return series.fillna(-1).astype("int8").to_numpy()
+
+def _to_categorical(series, known=()):
+    """Makes a categorical whose categories start with the `known` values."""
+    extra = pd.Index(series.dropna().unique()).difference(known)
+    return pd.Categorical(series, categories=[*known, *extra])
+
+def _recategorize(series, known=()):
+    """Gives a categorical the categories `_to_categorical` would give its values."""
+    codes = series.cat.codes.to_numpy()
+    # The values in order of first appearance, as `unique` finds them.
+    values = series.cat.categories[pd.unique(codes[codes >= 0])]
+    return series.cat.set_categories([*known, *values.difference(known)])
+
+def memory_footprint(df):
+    """Returns the number of bytes a frame takes, including its strings."""
+    return int(df.memory_usage(deep=True).sum())
+
+def prepare_database(conn):
+    """Migrates the tasks database to the latest schema version."""
+    if migrate(conn, TASK_MIGRATIONS):
+        # Cached frames were built from the old schema.
+        get_revision_cache().clear()
+
+def build_task_filter(filters):
+    """Builds a parameterized condition selecting the tasks matching `filters`.
+
+    `filters` maps column names to either a list of accepted values or an
+    inclusive `(low, high)` tuple. A None value means no restriction.
+    Returns the condition, empty if there is none, and its parameters.
+    """
+    clauses = []
+    params = []
+    for column, value in filters.items():
+        if column not in TASK_COLUMNS:
+            raise ValueError(f"Cannot filter on unknown column {column!r}")
+        if value is None:
+            continue
+        if isinstance(value, tuple):
+            clauses.append(f"{column} BETWEEN ? AND ?")
+            params.extend(value)
+        else:
+            value = list(value)
+            clauses.append(f"{column} IN ({', '.join('?' * len(value))})")
+            params.extend(value)
+
+    return " AND ".join(clauses), params
+
+def build_task_query(filters, search=None, columns=STORED_TASK_COLUMNS):
+    """Builds a parameterized query for the `columns` of the tasks matching `filters`.
+
+    See `build_task_filter`. With a `search`, only the tasks whose description
+    or contact person contain its words are kept, most relevant first.
+    Returns the SQL string and its parameters.
+    """
+    where, params = build_task_filter(filters)
+    fts_query = _to_fts_query(search)
+    if fts_query is None:
+        sql = f"SELECT {', '.join(columns)} FROM tasks"
+        order = "id"
+    else:
+        # The full-text index finds the matches, the filters then narrow them.
+        sql = (
+            f"SELECT {', '.join('tasks.' + column for column in columns)} FROM tasks JOIN ("
+            "SELECT rowid, rank FROM tasks_fts WHERE tasks_fts MATCH ?"
+            ") AS hits ON hits.rowid = tasks.id"
+        )
+        order = "hits.rank, id"
+        params = [fts_query, *params]
+    if where:
+        sql += " WHERE " + where
+    return sql + f" ORDER BY {order}", params
+
+def _to_fts_query(search):
+    """Turns what was typed in a search box into an FTS5 query.
+
+    Each word is quoted, so FTS5 operators are searched as plain text, and
+    matches as a prefix. All the words must be found. Returns None if there
+    is nothing to search for.
+    """
+    words = (search or "").split()
+    if not words:
+        return None
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+def query_tasks(conn, filters, search=None):
+    """Loads only the tasks matching `filters` and `search`, see `build_task_query`.
+
+    Filters are given as they appear in the app, i.e. status and priority
+    labels and `submission_date` as datetimes.
+
+    The database only finds the ids of the matching tasks, and only the ids
+    are cached until the tasks change. Their rows are taken from the frame of
+    all tasks, which `load_data` brings up to date by reading only the tasks
+    written since, so a query neither reads and decodes its tasks again after
+    a commit nor keeps a copy of them in the cache.
+    """
+    filters = _encode_filters(filters)
+    sql, params = build_task_query(filters, search, columns=["id"])
+    key = (getattr(conn, "db_filename", None), "query", sql, tuple(params))
+    revision = data_revision(conn, "tasks")
+
+    cache = get_revision_cache()
+    ids = cache.get(key, revision)
+    if ids is None:
+        ids = np.array([row_id for row_id, in conn.execute(sql, params)], dtype="int64")
+        cache.put(key, revision, ids)
+
+    df = _take_tasks(load_data(conn), ids)
+    if df is None:
+        # The tasks changed in between, or could not be read: read the matches.
+        sql, params = build_task_query(filters, search)
+        df = read_frame(conn, sql, params, types=STORED_TASK_TYPES)
+        with stage("decode tasks"):
+            df = _decode_tasks(df)
+    return df
+
+def _take_tasks(all_tasks, ids):
+    """Returns the tasks with `ids`, in that order, or None if some are missing."""
+    if all_tasks is None:
+        return None
+    positions = np.searchsorted(all_tasks["id"].to_numpy(), ids)
+    positions = positions.clip(0, max(len(all_tasks) - 1, 0))
+    if len(ids) and (not len(all_tasks) or (all_tasks["id"].to_numpy()[positions] != ids).any()):
+        return None
+    if len(positions) == len(all_tasks) and (positions == np.arange(len(positions))).all():
+        # All the tasks, in order: the frame itself will do.
+        return all_tasks
+    return all_tasks.iloc[positions].reset_index(drop=True)
+
+def load_task_page(conn, filters, sort_column="id", ascending=True, after=None, page_size=50):
+    """Loads one page of the tasks matching `filters`, see `keyset_page`.
+
+    Returns the page and the cursor of the next one.
+    """
+    where, params = build_task_filter(_encode_filters(filters))
+    rows, next_cursor = keyset_page(
+        conn, "tasks", STORED_TASK_COLUMNS, sort_column, ascending, after, page_size, where, params
+    )
+    return _decode_tasks(pd.DataFrame(rows, columns=STORED_TASK_COLUMNS)), next_cursor
+
+def count_tasks(conn, filters):
+    """Counts the tasks matching `filters`, cached until the tasks change."""
+    where, params = build_task_filter(_encode_filters(filters))
+    key = (getattr(conn, "db_filename", None), "count", where, tuple(params))
+    revision = data_revision(conn, "tasks")
+
+    cache = get_revision_cache()
+    count = cache.get(key, revision)
+    if count is None:
+        sql = "SELECT COUNT(*) FROM tasks" + (f" WHERE {where}" if where else "")
+        count = conn.execute(sql, params).fetchone()[0]
+        cache.put(key, revision, count)
+
+    return count
+
+def _encode_filters(filters):
+    encoded = dict(filters)
+    for column, labels in (("status", STATUSES), ("priority", PRIORITIES)):
+        if encoded.get(column) is not None:
+            encoded[column] = [labels.index(label) for label in encoded[column]]
+    if encoded.get("submission_date") is not None:
+        encoded["submission_date"] = tuple(map(_to_epoch, encoded["submission_date"]))
+    return encoded
+
+def load_filter_options(conn):
+    """Returns the values and bounds the task filter widgets offer.
+
+    Distinct values and the number of tasks with each come from the facets
+    the database keeps up to date, see `_index_task_facets`, and bounds from
+    index lookups, so none of it scans the tasks. `counts` maps each of
+    FACET_COLUMNS to its values and their counts. The result is cached until
+    the tasks table changes.
+    """
+    key = (getattr(conn, "db_filename", None), "filter_options")
+    revision = data_revision(conn, "tasks")
+
+    cache = get_revision_cache()
+    options = cache.get(key, revision)
+    if options is None:
+        counts = {column: {} for column in FACET_COLUMNS}
+        for column, value, count in conn.execute(
+            "SELECT column_name, value, count FROM task_facets ORDER BY column_name, value"
+        ):
+            counts[column][value] = count
+        for column, labels in (("status", STATUSES), ("priority", PRIORITIES)):
+            counts[column] = {labels[code]: count for code, count in counts[column].items()}
+
+        min_duration, max_duration, min_submission, max_submission = conn.execute(
+            """
+            SELECT
+                (SELECT MIN(duration) FROM tasks),
+                (SELECT MAX(duration) FROM tasks),
+                (SELECT MIN(submission_date) FROM tasks),
+                (SELECT MAX(submission_date) FROM tasks)
+            """
+        ).fetchone()
+        options = {
+            "contact_person": list(counts["contact_person"]),
+            "sub_system": list(counts["sub_system"]),
+            "duration": (min_duration, max_duration),
+            "submission_date": tuple(
+                pd.to_datetime([min_submission, max_submission], unit="s")
+            ),
+            "counts": counts,
+        }
+        cache.put(key, revision, options)
+
+    return options
 
-    cursor.execute(
+def _create_tasks_table(conn):
+    """Migration 1: creates the tasks table, or restores its `id` primary key.
+
+    Older versions of the Tasks page saved with `DataFrame.to_sql(if_exists='replace')`,
+    which recreates the table without its primary key and AUTOINCREMENT.
+    """
+    columns = conn.execute("PRAGMA table_info(tasks)").fetchall()
+    if not columns:
+        conn.execute(TASKS_TABLE_SCHEMA.format(table="tasks"))
+        return
+    if any(name == "id" and pk for _, name, _, _, _, pk in columns):
+        return
+
+    column_list = ", ".join(TASK_COLUMNS)
+    conn.execute(TASKS_TABLE_SCHEMA.format(table="tasks_repaired"))
+    conn.execute(
+        f"INSERT INTO tasks_repaired ({column_list}) SELECT {column_list} FROM tasks ORDER BY id"
+    )
+    conn.execute("DROP TABLE tasks")
+    conn.execute("ALTER TABLE tasks_repaired RENAME TO tasks")
+
+def _type_tasks_table(conn):
+    """Migration 2: stores dates as epoch seconds and status/priority as codes.
+
+    The codes are the positions in `STATUSES` and `PRIORITIES`, also kept in
+    lookup tables the coded columns reference. Dates were stored either as
+    'DD-MM-YYYY' or as 'YYYY-MM-DD HH:MM:SS' text.
+    """
+    for table, labels in (("task_statuses", STATUSES), ("task_priorities", PRIORITIES)):
+        conn.execute(
+            f"""
+            CREATE TABLE {table} (
+                code INTEGER PRIMARY KEY,
+                label TEXT NOT NULL UNIQUE COLLATE NOCASE
+            )
+            """
+        )
+        conn.executemany(f"INSERT INTO {table} (code, label) VALUES (?, ?)", enumerate(labels))
+
+    conn.execute(
         """
-        CREATE TABLE IF NOT EXISTS tasks (
+        CREATE TABLE tasks_typed (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             description TEXT,
             sub_system TEXT,
-            status TEXT,
-            priority TEXT,
-            submission_date DATETIME,
+            status INTEGER REFERENCES task_statuses (code),
+            priority INTEGER REFERENCES task_priorities (code),
+            submission_date INTEGER, -- Seconds since the Unix epoch.
             duration INTEGER,
             contact_person TEXT
         )
         """
     )
+    conn.execute(
+        """
+        INSERT INTO tasks_typed
+            (id, description, sub_system, status, priority, submission_date, duration, contact_person)
+        SELECT
+            id,
+            description,
+            sub_system,
+            (SELECT code FROM task_statuses WHERE label = tasks.status),
+            (SELECT code FROM task_priorities WHERE label = tasks.priority),
+            CAST(strftime('%s',
+                CASE WHEN submission_date GLOB '[0-9][0-9]-[0-9][0-9]-[0-9][0-9][0-9][0-9]*'
+                THEN substr(submission_date, 7, 4) || '-' || substr(submission_date, 4, 2) || '-' || substr(submission_date, 1, 2)
+                ELSE submission_date END
+            ) AS INTEGER),
+            duration,
+            contact_person
+        FROM tasks
+        ORDER BY id
+        """
+    )
+    conn.execute("DROP TABLE tasks")
+    conn.execute("ALTER TABLE tasks_typed RENAME TO tasks")
+
+def _index_tasks_table(conn):
+    """Migration 3: indexes the columns the home page filters on."""
+    for column in INDEXED_COLUMNS:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS tasks_{column} ON tasks ({column})")
+    # Refresh the planner statistics so it picks the most selective index.
+    conn.execute("PRAGMA optimize")
+
+def _track_tasks_revisions(conn):
+    """Migration 4: keeps a revision counter of the tasks table for the caches."""
+    track_revisions(conn, "tasks")
 
-    cursor.execute(
+def _index_tasks_text(conn):
+    """Migration 5: indexes the words of the descriptions and contact persons.
+
+    `tasks_fts` is an FTS5 table over the `tasks` rows, which triggers keep in
+    sync on every write. It stores only the index, the text stays in `tasks`.
+    """
+    conn.execute(
         """
-        INSERT INTO tasks
-            (description, sub_system, status, priority, submission_date, duration, contact_person)
-        VALUES
-            ('This is a test task.', 'HV', 'Not Started', 'Low', '27-02-2025', 10, 'Marion'),
-            ('This is an important test task.', 'HV', 'Not Started', 'High', '27-02-2025', 20, 'Marion'),
-            ('This is a another test task.', 'LV', 'Not Started', 'Medium', '27-02-2025', 10, 'Michal'),
-            ('Have organisation meeting', 'Planning', 'In Progress', 'Low', '28-02-2025', 2, 'Marion')
+        CREATE VIRTUAL TABLE tasks_fts USING fts5(
+            description,
+            contact_person,
+            content = 'tasks',
+            content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
         """
     )
-    conn.commit()
+    # FTS5 removes the words of a row by being given its old values.
+    conn.execute(
+        """
+        CREATE TRIGGER tasks_fts_insert AFTER INSERT ON tasks BEGIN
+            INSERT INTO tasks_fts (rowid, description, contact_person)
+            VALUES (new.id, new.description, new.contact_person);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER tasks_fts_delete AFTER DELETE ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, description, contact_person)
+            VALUES ('delete', old.id, old.description, old.contact_person);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER tasks_fts_update AFTER UPDATE OF description, contact_person ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, description, contact_person)
+            VALUES ('delete', old.id, old.description, old.contact_person);
+            INSERT INTO tasks_fts (rowid, description, contact_person)
+            VALUES (new.id, new.description, new.contact_person);
+        END
+        """
+    )
+    conn.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
 
-def load_data(conn):
-    """Loads the tasks data from the database."""
-    cursor = conn.cursor()
+def _version_tasks_table(conn):
+    """Migration 6: numbers the versions of each task, see `write_changes`."""
+    conn.execute("ALTER TABLE tasks ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+    conn.execute("ALTER TABLE tasks ADD COLUMN updated_at INTEGER")  # Seconds since the Unix epoch.
 
-    try:
-        cursor.execute("SELECT * FROM tasks")
-        data = cursor.fetchall()
-    except:
+def _log_tasks_changes(conn):
+    """Migration 7: logs which tasks each write touched, see `update_tasks`."""
+    track_changes(conn, "tasks")
+
+def _create_task_dependencies(conn):
+    """Migration 8: lets tasks depend on others, see `utils.scheduling`."""
+    conn.execute(DEPENDENCIES_TABLE_SCHEMA)
+    # Deleting a task looks up the tasks depending on it.
+    conn.execute("CREATE INDEX IF NOT EXISTS task_dependencies_depends_on ON task_dependencies (depends_on)")
+    track_revisions(conn, "task_dependencies")
+
+def _index_task_facets(conn):
+    """Migration 9: counts the tasks with each value of the FACET_COLUMNS.
+
+    Triggers keep the counts up to date on every write, and drop the values
+    no task has any more, so the filter widgets never scan the tasks.
+    """
+    conn.execute(
+        """
+        CREATE TABLE task_facets (
+            column_name TEXT NOT NULL,
+            value NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (column_name, value)
+        ) WITHOUT ROWID
+        """
+    )
+    for column in FACET_COLUMNS:
+        conn.execute(
+            f"""
+            INSERT INTO task_facets (column_name, value, count)
+            SELECT '{column}', {column}, COUNT(*) FROM tasks
+            WHERE {column} IS NOT NULL GROUP BY {column}
+            """
+        )
+
+    # The WHERE clauses also keep SQLite from reading ON CONFLICT as a join.
+    def add(column, only_if="1"):
+        return f"""
+            INSERT INTO task_facets (column_name, value, count)
+            SELECT '{column}', new.{column}, 1 WHERE new.{column} IS NOT NULL AND {only_if}
+            ON CONFLICT (column_name, value) DO UPDATE SET count = count + 1;"""
+
+    def remove(column, only_if="1"):
+        return f"""
+            UPDATE task_facets SET count = count - 1
+            WHERE column_name = '{column}' AND value = old.{column} AND {only_if};
+            DELETE FROM task_facets
+            WHERE column_name = '{column}' AND value = old.{column} AND count = 0;"""
+
+    # Edits write every column, so updates only count the values that changed.
+    changed = {column: f"new.{column} IS NOT old.{column}" for column in FACET_COLUMNS}
+    conn.execute(
+        f"""
+        CREATE TRIGGER task_facets_insert AFTER INSERT ON tasks
+        BEGIN{''.join(add(column) for column in FACET_COLUMNS)}
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER task_facets_delete AFTER DELETE ON tasks
+        BEGIN{''.join(remove(column) for column in FACET_COLUMNS)}
+        END
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER task_facets_update AFTER UPDATE OF {', '.join(FACET_COLUMNS)} ON tasks
+        BEGIN{''.join(remove(column, changed[column]) + add(column, changed[column]) for column in FACET_COLUMNS)}
+        END
+        """
+    )
+
+# Never edit or reorder these, only append: a database's `user_version` is
+# the number of them it has already gone through.
+TASK_MIGRATIONS = [
+    _create_tasks_table,
+    _type_tasks_table,
+    _index_tasks_table,
+    _track_tasks_revisions,
+    _index_tasks_text,
+    _version_tasks_table,
+    _log_tasks_changes,
+    _create_task_dependencies,
+    _index_task_facets,
+]
+
+def _to_db_value(value):
+    """Converts pandas/numpy scalars to something sqlite3 can bind."""
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def _to_epoch(value):
+    """Converts a date to the seconds since the Unix epoch stored in the database."""
+    return None if pd.isna(value) else int(pd.Timestamp(value).timestamp())
+
+def _to_code(labels, value):
+    """Converts a status or priority label to the code stored in the database."""
+    if pd.isna(value):
         return None
+    if value not in labels:
+        raise ValueError(f"{value!r} is not one of {labels}")
+    return labels.index(value)
+
+def _to_db_row(row):
+    """Converts a task as shown in the app to the values stored in the database."""
+    row = {column: _to_db_value(row.get(column)) for column in [*TASK_COLUMNS, "version"]}
+    row["status"] = _to_code(STATUSES, row["status"])
+    row["priority"] = _to_code(PRIORITIES, row["priority"])
+    row["submission_date"] = _to_epoch(row["submission_date"])
+    return row
+
+def commit_changes(conn, rows, deleted_ids):
+    """Writes tasks and deletes task ids in one transaction, see `write_changes`."""
+    with conn:
+        return write_changes(conn, rows, deleted_ids)
+
+def write_changes(conn, rows, deleted_ids):
+    """Writes tasks and deletes task ids, in the caller's transaction.
 
-    df = pd.DataFrame(
-        data,
-        columns=[
-            "id",
-            "description",
-            "sub_system",
-            "status",
-            "priority",
-            "submission_date",
-            "duration",
-            "contact_person",
-        ],
+    `rows` are tasks as shown in the app. Rows without an id are inserted,
+    get the next AUTOINCREMENT id and, if they have none, today's date.
+    Rows with an id only update their task if it is still at the `version`
+    the row was read at, and `deleted_ids` may likewise map ids to versions.
+    Each write bumps the version, so changes someone else saved in the
+    meantime are never overwritten.
+
+    Returns the conflicts, as dicts holding the task `id`, the row that was
+    not written as `mine` and the task now stored as `theirs`. `mine` is
+    None for a delete and `theirs` None for a task deleted in the meantime.
+    """
+    today = pd.Timestamp.now().normalize()
+    now = int(time.time())
+    inserted = [
+        {**_to_db_row({"submission_date": today, **row}), "updated_at": now}
+        for row in rows if row.get("id") is None
+    ]
+    conn.executemany(
+        """
+        INSERT INTO tasks
+            (description, sub_system, status, priority, submission_date, duration, contact_person, updated_at)
+        VALUES
+            (:description, :sub_system, :status, :priority, :submission_date, :duration, :contact_person, :updated_at)
+        """,
+        inserted,
     )
 
-    return df
+    conflicts = {}
+    for row in rows:
+        if row.get("id") is None:
+            continue
+        cursor = conn.execute(
+            """
+            UPDATE tasks SET
+                description = :description,
+                sub_system = :sub_system,
+                status = :status,
+                priority = :priority,
+                submission_date = :submission_date,
+                duration = :duration,
+                contact_person = :contact_person,
+                version = version + 1,
+                updated_at = :updated_at
+            WHERE id = :id AND (:version IS NULL OR version = :version)
+            """,
+            {**_to_db_row(row), "updated_at": now},
+        )
+        if cursor.rowcount == 0:
+            conflicts[row["id"]] = row
+
+    versions = deleted_ids if isinstance(deleted_ids, dict) else dict.fromkeys(deleted_ids)
+    for task_id, version in versions.items():
+        cursor = conn.execute(
+            "DELETE FROM tasks WHERE id = ? AND (? IS NULL OR version = ?)",
+            (_to_db_value(task_id), _to_db_value(version), _to_db_value(version)),
+        )
+        if cursor.rowcount == 0:
+            conflicts[task_id] = None
+
+    return _describe_conflicts(conn, conflicts)
+
+def _describe_conflicts(conn, conflicts):
+    """Pairs the rows that were not written with the tasks now stored."""
+    if not conflicts:
+        return []
+    ids = [_to_db_value(task_id) for task_id in conflicts]
+    data = conn.execute(
+        f"SELECT {', '.join(STORED_TASK_COLUMNS)} FROM tasks WHERE id IN ({', '.join('?' * len(ids))})",
+        ids,
+    ).fetchall()
+    theirs = _decode_tasks(pd.DataFrame(data, columns=STORED_TASK_COLUMNS)).to_dict("records")
+    theirs = {row["id"]: row for row in theirs}
+    return [
+        {"id": task_id, "mine": mine, "theirs": theirs.get(task_id)}
+        for task_id, mine in conflicts.items()
+        # Deleting a task someone else deleted too is no conflict.
+        if mine is not None or task_id in theirs
+    ]
+
+def import_tasks(conn, chunks, on_progress=None):
+    """Inserts tasks read with `read_chunks`, see `import_chunks`.
+
+    Files hold tasks as shown in the app, i.e. status and priority labels and
+    dates. Their ids are ignored, the tasks get new ones. Tasks without a
+    date get today's.
+    """
+    today = pd.Timestamp.now().normalize()
+    now = int(time.time())
+
+    def encode(row):
+        if pd.isna(row.get("submission_date")):
+            row["submission_date"] = today
+        if row.get("sub_system") not in SUBSYSTEMS:
+            raise ValueError(f"{row.get('sub_system')!r} is not one of {SUBSYSTEMS}")
+        duration = row.get("duration")
+        if not pd.isna(duration) and (float(duration) < 0 or float(duration) % 1):
+            raise ValueError(f"duration {duration!r} is not a number of days")
+        return {**_to_db_row(row), "updated_at": now}
+
+    return import_chunks(
+        conn, "tasks", [*TASK_COLUMNS[1:], "updated_at"], chunks, encode,
+        required=["description", "sub_system", "status", "priority"],
+        on_progress=on_progress,
+    )
+
+def export_tasks(conn, fmt):
+    """Returns all tasks as a CSV or Parquet file, in the format `import_tasks` reads."""
+    chunks = export_chunks(
+        conn, f"SELECT {', '.join(TASK_COLUMNS)} FROM tasks ORDER BY id", TASK_COLUMNS, _decode_tasks
+    )
+    return export_bytes(chunks, fmt)
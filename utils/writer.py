@@ -0,0 +1,109 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+import streamlit as st
+
+from utils.connection import ConnectionManager
+
+# Commits applied together in one transaction, at most.
+MAX_BATCH = 64
+
+
+class WriteQueue:
+    """Applies the writes of every session to a database from a single thread.
+
+    Writes waiting in the queue when the thread gets to them are applied in
+    one transaction, so concurrent commits cost one fsync instead of one each
+    and never wait on each other for the database lock. Each write runs in a
+    savepoint: a failing write is rolled back alone.
+    """
+
+    def __init__(self, db_filename, max_batch=MAX_BATCH):
+        self.db_filename = Path(db_filename)
+        self.max_batch = max_batch
+        # `lock_wait_s` is the time spent waiting for other writers, like
+        # migrations and imports, to release the database.
+        self.stats = {"writes": 0, "failed": 0, "transactions": 0, "lock_wait_s": 0.0}
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name=f"writer-{self.db_filename.name}", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, write, *args):
+        """Queues `write(conn, *args)` and returns a future of its result.
+
+        `write` must not commit or roll back, the queue does.
+        """
+        future = Future()
+        self._queue.put((future, write, args))
+        return future
+
+    def close(self):
+        """Applies the writes already queued and stops the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        manager = ConnectionManager(self.db_filename)
+        conn, _ = manager.connect()
+        while True:
+            jobs = [self._queue.get()]
+            while len(jobs) < self.max_batch:
+                try:
+                    jobs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in jobs
+            jobs = [job for job in jobs if job is not None]
+            if jobs:
+                self._apply(conn, jobs)
+            if stop:
+                manager.close_all()
+                return
+
+    def _apply(self, conn, jobs):
+        outcomes = []
+        try:
+            start = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            self.stats["lock_wait_s"] += time.perf_counter() - start
+            for future, write, args in jobs:
+                conn.execute("SAVEPOINT write")
+                try:
+                    result = write(conn, *args)
+                except Exception as error:
+                    conn.execute("ROLLBACK TO write")
+                    outcomes.append((future, None, error))
+                else:
+                    outcomes.append((future, result, None))
+                conn.execute("RELEASE write")
+            conn.commit()
+        except Exception as error:
+            if conn.in_transaction:
+                conn.rollback()
+            outcomes = [(future, None, error) for future, _, _ in jobs]
+
+        self.stats["transactions"] += 1
+        for future, result, error in outcomes:
+            self.stats["writes"] += 1
+            if error is None:
+                future.set_result(result)
+            else:
+                self.stats["failed"] += 1
+                future.set_exception(error)
+
+
+@st.cache_resource
+def get_write_queue(db_filename):
+    """Returns the process-wide write queue of a database file."""
+    return WriteQueue(db_filename)
+
+
+def submit_write(db_filename, write, *args):
+    """Queues a write to a database, see `WriteQueue.submit`."""
+    return get_write_queue(str(Path(db_filename).resolve())).submit(write, *args)